@@ -11,7 +11,8 @@ from sqlalchemy.exc import SQLAlchemyError
 
 # Импорт из моего модуля
 from db_actions import register_user, update_user, add_transcription, get_user_by_tg_id, get_transcriptions_by_user, \
-    get_transactions_by_date_range, set_transcription_score, get_transcription
+    get_transactions_by_date_range, set_transcription_score, get_transcription, score_transcription, \
+    get_cached_transcript, save_cached_transcript
 
 db_user = os.environ['DB_USER']
 db_pass = os.environ['DB_PASSWORD']
@@ -56,6 +57,11 @@ class UserUpdateRequest(BaseModel):
     role: Optional[int] = None
 
 
+class TranscriptCacheRequest(BaseModel):
+    prediction: str
+    duration_seconds: float
+
+
 # Модель для валидации транзакций
 class TransactionResponse(BaseModel):
     id: int
@@ -171,6 +177,27 @@ async def change_transcription_score(transcription_id: int, score: int, session:
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
 
 
+# Роут для оценки транскрипции с начислением монет и повышением роли одной транзакцией
+@app.post("/score-transcription/{transcription_id}")
+async def score_transcription_and_reward(transcription_id: int, score: int,
+                                         session: AsyncSession = Depends(get_session)):
+    # Оценка 0 означает "не оценено"
+    if score <= 0:
+        raise HTTPException(status_code=400, detail="Score must be positive")
+    try:
+        result = await score_transcription(transcription_id, score, session)
+        if result is None:
+            raise HTTPException(status_code=404, detail="Transcription not found")
+        return {
+                "status": "success" if result["scored"] else "already_scored",
+                "message": "Transcription scored",
+                "data": result,
+        }
+    except SQLAlchemyError as e:
+        logger.error(f"Database error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Database error occurred")
+
+
 # Роут для получения транзакций за определенный промежуток времени
 @app.get("/transactions/", response_model=List[TransactionResponse])
 async def get_transactions(
@@ -237,6 +264,31 @@ async def update_user_role(user_id: int, new_role: int, session: AsyncSession =
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
 
+# Роут для получения готовой транскрипции по file_unique_id или хешу аудио
+@app.get("/transcript-cache/{cache_key}")
+async def get_transcript_cache(cache_key: str, session: AsyncSession = Depends(get_session)):
+    try:
+        cached = await get_cached_transcript(cache_key, session)
+        if cached is None:
+            raise HTTPException(status_code=404, detail="Transcript not cached")
+        return {"prediction": cached.prediction, "duration_seconds": cached.duration_seconds}
+    except SQLAlchemyError as e:
+        logger.error(f"Database error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Database error occurred")
+
+
+# Роут для сохранения транскрипции в кеш
+@app.put("/transcript-cache/{cache_key}")
+async def put_transcript_cache(cache_key: str, request: TranscriptCacheRequest,
+                               session: AsyncSession = Depends(get_session)):
+    try:
+        await save_cached_transcript(cache_key, request.prediction, request.duration_seconds, session)
+        return {"status": "success", "message": "Transcript cached"}
+    except SQLAlchemyError as e:
+        logger.error(f"Database error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Database error occurred")
+
+
 # Запуск Uvicorn при запуске скрипта
 if __name__ == "__main__":
     import uvicorn
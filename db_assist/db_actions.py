@@ -1,16 +1,29 @@
 import logging
 from typing import Optional
 
+from decimal import Decimal
+
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.exc import SQLAlchemyError
 from datetime import datetime, date
-from models import User, Transcription
+from models import User, Transcription, TranscriptCache
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Начисление за оценку: монет за секунду аудио, для сообщений от 20 до 30 секунд - с коэффициентом
+REWARD_PER_SECOND = 0.016 * 5
+REWARD_BONUS_MIN_SECONDS = 20
+REWARD_BONUS_MAX_SECONDS = 30
+REWARD_BONUS = 1.5
+# Набравший столько монет пользователь становится beta-tester
+PROMOTION_CASH = 960
+BETA_TESTER_ROLE = 1
+
 
 async def register_user(tg_id: int, cash: float, role: int, session: AsyncSession):
     try:
@@ -151,3 +164,78 @@ async def get_transactions_by_date_range(start_date: date, end_date: date, sessi
     except SQLAlchemyError as e:
         logger.error(f"Error fetching transactions: {str(e)}")
         raise
+
+
+def calculate_reward(duration_seconds: int) -> Decimal:
+    k = REWARD_PER_SECOND
+    if REWARD_BONUS_MIN_SECONDS < duration_seconds < REWARD_BONUS_MAX_SECONDS:
+        k *= REWARD_BONUS
+    return Decimal(str(round(k * duration_seconds, 2)))
+
+
+# Оценка транскрипции и начисление монет одной транзакцией
+async def score_transcription(transcription_id: int, score: int, session: AsyncSession):
+    try:
+        # Оценка ставится один раз: строка обновляется, только если транскрипция ещё не оценена,
+        # поэтому повторное нажатие не начислит монеты второй раз
+        result = await session.execute(
+            update(Transcription)
+            .where(Transcription.pk == transcription_id, Transcription.score == 0)
+            .values(score=score)
+            .returning(Transcription.user_id, Transcription.duration_seconds)
+        )
+        scored = result.first()
+
+        if scored is None:
+            transcription = await get_transcription(transcription_id, session)
+            if not transcription:
+                logger.error(f"Transcription {transcription_id} not found.")
+                return None
+            user = await session.get(User, transcription.user_id)
+            await session.commit()
+            logger.info(f"Transcription {transcription_id} is already scored.")
+            return {"scored": False, "reward": 0, "tg_id": user.tg_id, "cash": user.cash, "role": user.role,
+                    "promoted": False}
+
+        # Строка пользователя блокируется до конца транзакции, параллельные начисления идут по очереди
+        result = await session.execute(select(User).filter_by(pk=scored.user_id).with_for_update())
+        user = result.scalars().first()
+        reward = calculate_reward(scored.duration_seconds)
+        user.cash += reward
+        promoted = user.cash >= PROMOTION_CASH and user.role < BETA_TESTER_ROLE
+        if promoted:
+            user.role = BETA_TESTER_ROLE
+
+        await session.commit()
+        logger.info(f"Transcription {transcription_id} scored {score}, user {user.tg_id} rewarded {reward}.")
+        return {"scored": True, "reward": reward, "tg_id": user.tg_id, "cash": user.cash, "role": user.role,
+                "promoted": promoted}
+    except SQLAlchemyError as e:
+        logger.error(f"Error scoring transcription: {str(e)}")
+        await session.rollback()
+        raise
+
+
+# Получение готовой транскрипции по ключу кеша
+async def get_cached_transcript(cache_key: str, session: AsyncSession):
+    try:
+        return await session.get(TranscriptCache, cache_key)
+    except SQLAlchemyError as e:
+        logger.error(f"Error getting cached transcript: {str(e)}")
+        raise
+
+
+# Сохранение транскрипции в кеш; если ключ уже есть, запись не меняется
+async def save_cached_transcript(cache_key: str, prediction: str, duration_seconds: float, session: AsyncSession):
+    try:
+        await session.execute(
+            insert(TranscriptCache)
+            .values(cache_key=cache_key, prediction=prediction, duration_seconds=duration_seconds)
+            .on_conflict_do_nothing(index_elements=[TranscriptCache.cache_key])
+        )
+        await session.commit()
+        logger.info(f"Cached transcript {cache_key}.")
+    except SQLAlchemyError as e:
+        logger.error(f"Error caching transcript: {str(e)}")
+        await session.rollback()
+        raise
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Numeric, func
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Numeric, Float, Text, func
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -41,3 +41,13 @@ class Transaction(Base):
     user_id = Column(Integer, ForeignKey('users.pk'), nullable=False)
     date_of_transaction = Column(DateTime, default=func.now(), nullable=False)
     amount = Column(Numeric(10, 2), nullable=False)
+
+
+# Готовые транскрипции по file_unique_id Telegram или хешу содержимого аудио
+class TranscriptCache(Base):
+    __tablename__ = 'transcript_cache'
+
+    cache_key = Column(String, primary_key=True)
+    creation_datetime = Column(DateTime, default=func.now(), nullable=False)
+    prediction = Column(Text, nullable=False)
+    duration_seconds = Column(Float, nullable=False)
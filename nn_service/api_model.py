@@ -1,54 +1,358 @@
-import torch
-from fastapi import FastAPI, File, UploadFile, HTTPException
+import asyncio
+import json
 import os
-import tempfile
+import signal
+import time
+from collections import deque
+
+import torch
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from pydantic import BaseModel
+from typing import List, Optional
 import logging
 
 
-from transformers import pipeline
+from backends import load_pipeline
+from audio_decoding import decode_audio, AudioDecodingError, SAMPLING_RATE
+from model_manager import ModelManager
+from inference_scheduler import InferenceScheduler, QueueFullError, INFERENCE_WORKERS
+from prefork import PREFORK_WORKERS, start_prefork_pool
+from streaming import iter_windows, window_bounds, select_segments, STREAM_LOOKAHEAD
+from vad import apply_vad, map_segments, VAD_ENABLED
+from bulk_jobs import BulkJobManager
+from decoding import DecodingPolicy, resolve_policy, generate_kwargs
+from job_queue import JOB_TRANSPORT, TranscriptionConsumer, JobRejected, create_broker
+from metrics import REQUEST_LATENCY, DECODE_LATENCY, IN_FLIGHT, QUEUED, ERRORS, observe_audio
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-# Инициализируем модель
-pipe = pipeline(task="automatic-speech-recognition", model="./whisper-small-ru", device=device)
+# Режим длинных аудио: chunked - нарезка на перекрывающиеся куски, которые идут через модель батчем;
+# sequential - штатная длинноформатная генерация whisper, окно за окном
+LONG_FORM_MODE = os.getenv('LONG_FORM_MODE', 'chunked')
+CHUNK_LENGTH_S = float(os.getenv('CHUNK_LENGTH_S', '30'))
+# Перекрытие с каждой стороны куска, по нему pipeline склеивает текст
+CHUNK_STRIDE_S = float(os.getenv('CHUNK_STRIDE_S', '5'))
+CHUNK_BATCH_SIZE = int(os.getenv('CHUNK_BATCH_SIZE', '8'))
+
+# Модель выбранного бэкенда (ASR_BACKEND) загружается при старте сервиса, а не при импорте
+model = ModelManager(lambda: load_pipeline(device))
+
+
+def transcribe_batch(audios: list, policy: DecodingPolicy | None = None) -> list:
+    """Прогоняет батч декодированных аудио (float32, 16 кГц) через модель за один вызов pipeline.
+    Все аудио батча декодируются с одной политикой, бюджет токенов - по самому длинному."""
+    policy = policy or DecodingPolicy()
+    longest = max(len(audio) for audio in audios) / SAMPLING_RATE
+    has_long_form = longest > CHUNK_LENGTH_S
+    kwargs = {"generate_kwargs": generate_kwargs(policy, longest)}
+    with model.acquire() as pipe:
+        if LONG_FORM_MODE == 'chunked' and has_long_form:
+            # Куски всех файлов батча прогоняются через энкодер/декодер вместе, затем склеиваются по перекрытию
+            outputs = pipe(audios, chunk_length_s=CHUNK_LENGTH_S, stride_length_s=CHUNK_STRIDE_S,
+                           batch_size=CHUNK_BATCH_SIZE, return_timestamps=policy.timestamps, **kwargs)
+        else:
+            # Штатная длинноформатная генерация whisper работает только с метками времени
+            outputs = pipe(audios, batch_size=len(audios), return_timestamps=policy.timestamps or has_long_form,
+                           **kwargs)
+    return [{"text": output["text"], "chunks": output.get("chunks", [])} for output in outputs]
+
+
+# В режиме prefork каждый цикл батчинга обслуживает один процесс инференса
+scheduler = InferenceScheduler(transcribe_batch,
+                               workers=PREFORK_WORKERS if PREFORK_WORKERS > 1 else INFERENCE_WORKERS)
+QUEUED.set_function(lambda: scheduler.queue_size)
+# Пакетные задачи идут через тот же планировщик с приоритетом ниже пользовательского
+bulk_jobs = BulkJobManager(scheduler)
+# Очередь задач от бота (JOB_TRANSPORT=amqp): каждый экземпляр сервиса - ещё один потребитель
+broker = create_broker() if JOB_TRANSPORT != 'http' else None
+
+
+async def restart_prefork_pool():
+    """Новый пул prefork взамен сломанного: умерший процесс ломает ProcessPoolExecutor навсегда."""
+    model.ready = False
+    try:
+        pool = await asyncio.to_thread(start_prefork_pool, PREFORK_WORKERS, model.warmup)
+    except Exception:
+        # Без процессов инференса сервис бесполезен - завершаемся, контейнер перезапустится
+        logging.error('Inference workers are not restarted, shutting down')
+        os.kill(os.getpid(), signal.SIGTERM)
+        raise
+    model.ready = True
+    return pool
+
+
+async def start_model():
+    try:
+        if PREFORK_WORKERS > 1:
+            # Модель загружается один раз здесь, процессы инференса получают её веса через fork
+            await asyncio.to_thread(model.load)
+            pool = await asyncio.to_thread(start_prefork_pool, PREFORK_WORKERS, model.warmup)
+            await scheduler.start(executor=pool, restart_executor=restart_prefork_pool)
+            model.ready = True
+        else:
+            await scheduler.start()
+            await asyncio.to_thread(model.start)
+        # Незавершённые пакетные задачи продолжаются после перезапуска
+        bulk_jobs.resume_all()
+        if broker is not None:
+            # Задачи из очереди забираем, только когда модель готова
+            await broker.connect()
+            await TranscriptionConsumer(broker, transcribe_job).start()
+    except Exception as e:
+        logging.error(f'Model startup failed: {e}')
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Загрузка и прогрев идут в фоне: uvicorn уже принимает /health, а /ready ответит после прогрева
+    startup = asyncio.create_task(start_model())
+    # Процессы prefork держат свои копии ссылок на модель, выгрузка в родителе память не освободит
+    idle_watcher = asyncio.create_task(model.watch_idle()) if PREFORK_WORKERS <= 1 else None
+    yield
+    startup.cancel()
+    if idle_watcher:
+        idle_watcher.cancel()
+    await bulk_jobs.stop()
+    if broker is not None:
+        await broker.close()
+    await scheduler.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logging.info(f'device: {device}')
 
 
+def load_audio(data: bytes, content_type: str | None):
+    """Декодирует аудио и вырезает тишину, если включён VAD. Возвращает исходное аудио, аудио для модели
+    и карту времени (или None)."""
+    started = time.perf_counter()
+    try:
+        audio = decode_audio(data, content_type)
+    except AudioDecodingError as e:
+        ERRORS.labels('decode').inc()
+        raise HTTPException(status_code=415, detail=str(e))
+    speech, speech_map = apply_vad(audio) if VAD_ENABLED else (audio, None)
+    DECODE_LATENCY.observe(time.perf_counter() - started)
+    return audio, speech, speech_map
+
+
+def log_transcription(text: str, audio, speech_map, model_seconds: float, endpoint: str):
+    duration = len(audio) / SAMPLING_RATE
+    trimmed = 0.0 if speech_map is None else speech_map.trimmed_seconds
+    observe_audio(duration, trimmed, model_seconds, endpoint)
+    logging.info(f'Transcribed {duration:.1f} s (VAD trimmed {trimmed:.1f} s): {text}')
+
+
+def priority_class(priority: int) -> int:
+    """Класс приоритета по роли пользователя бота: 0 - user, 1 - beta-tester, 2 - unlimited, 3 - admin."""
+    return min(max(priority, 0), 3)
+
+
+def decoding_policy(name: str | None, priority: int, timestamps: bool = True) -> DecodingPolicy:
+    try:
+        return resolve_policy(name, priority, timestamps)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def queue_full_error(e: QueueFullError) -> HTTPException:
+    ERRORS.labels('queue_full').inc()
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+def ensure_ready():
+    if not model.ready:
+        ERRORS.labels('not_ready').inc()
+        raise HTTPException(status_code=503, detail="Model is loading", headers={"Retry-After": "5"})
+
+
+# Liveness: процесс жив и обрабатывает запросы
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+# Readiness: модель загружена и прогрета
+@app.get("/ready")
+async def ready():
+    ensure_ready()
+    return {"status": "ready", "model_loaded": model.loaded}
+
+
+# Метрики в формате Prometheus
+@app.get("/metrics")
+async def metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 # Эндпоинт для предсказаний на основе аудиофайла
 @app.post("/predict")
-async def predict(file: UploadFile = File(...)):
+async def predict(file: UploadFile = File(...), priority: int = Form(0), policy: Optional[str] = Form(None),
+                  timestamps: bool = Form(True)):
+    ensure_ready()
+    priority = priority_class(priority)
+    decoding = decoding_policy(policy, priority, timestamps)
+    with REQUEST_LATENCY.labels('predict').time(), IN_FLIGHT.labels('predict').track_inprogress():
+        try:
+            # Декодируем аудио (OGG/Opus, WAV или PCM) прямо в памяти, в отдельном потоке:
+            # на длинных записях это секунды, и event loop не должен на них останавливаться
+            audio, speech, speech_map = await asyncio.to_thread(load_audio, await file.read(), file.content_type)
+            if not len(speech):
+                log_transcription('', audio, speech_map, 0.0, 'predict')
+                return {"prediction": "", "segments": []}
+
+            # Используем модель для транскрипции (запрос попадает в общий батч)
+            started = time.perf_counter()
+            try:
+                result = await scheduler.submit(speech, priority, len(speech) / SAMPLING_RATE, decoding)
+            except QueueFullError as e:
+                raise queue_full_error(e)
+            transcription = result["text"]
+            log_transcription(transcription, audio, speech_map, time.perf_counter() - started, 'predict')
+
+            segments = select_segments(result["chunks"], 0.0, len(speech) / SAMPLING_RATE, 0.0, float('inf'))
+            return {"prediction": transcription, "segments": map_segments(segments, speech_map)}
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            ERRORS.labels('inference').inc()
+            raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
+
+async def enqueue_with_retry(audio, priority: int, decoding: DecodingPolicy):
+    """Ставит окно в очередь; поток уже начат, поэтому при переполнении ждём, а не отказываем."""
+    while True:
+        try:
+            return scheduler.enqueue(audio, priority, len(audio) / SAMPLING_RATE, decoding)
+        except QueueFullError as e:
+            await asyncio.sleep(e.retry_after)
+
+
+async def transcribe_job(data: bytes, headers: dict) -> dict:
+    """Задача из очереди: то же, что /predict, но вместо отказа при переполнении очереди ждёт."""
     try:
+        audio, speech, speech_map = await asyncio.to_thread(load_audio, data, headers.get('content_type'))
+        priority = priority_class(int(headers.get('priority', 0)))
+        decoding = decoding_policy(headers.get('policy'), priority, bool(headers.get('timestamps', True)))
+    except HTTPException as e:
+        raise JobRejected(e.detail)
+    if not len(speech):
+        log_transcription('', audio, speech_map, 0.0, 'queue')
+        return {"prediction": "", "segments": []}
 
-        # await asyncio.sleep(0)  # Отправляем немедленно
-        # Создаем временный файл
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_file:
-            temp_file.write(await file.read())
-            temp_file.flush()
-            file_location = temp_file.name
+    started = time.perf_counter()
+    with IN_FLIGHT.labels('queue').track_inprogress():
+        result = await (await enqueue_with_retry(speech, priority, decoding))
+    log_transcription(result["text"], audio, speech_map, time.perf_counter() - started, 'queue')
+    segments = select_segments(result["chunks"], 0.0, len(speech) / SAMPLING_RATE, 0.0, float('inf'))
+    return {"prediction": result["text"], "segments": map_segments(segments, speech_map)}
 
-        # Используем модель для транскрипции
-        transcription = pipe(file_location, return_timestamps=True)["text"]
-        logging.info(transcription)
 
-        # current_time = datetime.now()
-        # # Формируем строку в нужном формате (например, YYYY-MM-DD_HH-MM-SS)
-        # filename = current_time.strftime("%Y-%m-%d_%H-%M-%S")
-        # logging.info(f'filename: {filename}, file: {file_location}')
+# Эндпоинт потоковой транскрипции: сегменты отдаются в формате NDJSON по мере распознавания окон
+@app.post("/predict-stream")
+async def predict_stream(file: UploadFile = File(...), priority: int = Form(0),
+                         policy: Optional[str] = Form(None)):
+    ensure_ready()
+    priority = priority_class(priority)
+    # Границы окон сшиваются по меткам времени, поэтому здесь они нужны всегда
+    decoding = decoding_policy(policy, priority)
+    request_started = time.perf_counter()
+    audio, speech, speech_map = await asyncio.to_thread(load_audio, await file.read(), file.content_type)
+    windows = list(iter_windows(speech)) if len(speech) else []
 
-        # upload_to_s3(audio_file_path=file_location, transcription_text=transcription, file_name=file.filename)
+    # Первые окна ставим в очередь до начала ответа, чтобы при перегрузке вернуть 503
+    pending = deque()
+    try:
+        for _, window in windows[:max(1, STREAM_LOOKAHEAD)]:
+            pending.append(scheduler.enqueue(window, priority, len(window) / SAMPLING_RATE, decoding))
+    except QueueFullError as e:
+        for future in pending:
+            future.cancel()
+        raise queue_full_error(e)
 
-        # Удаляем временный файл
-        os.remove(file_location)
+    async def stream_segments():
+        next_index = len(pending)
+        texts = []
+        model_started = time.perf_counter()
+        IN_FLIGHT.labels('predict-stream').inc()
+        try:
+            for index, (offset, window) in enumerate(windows):
+                current = pending.popleft()
+                if next_index < len(windows):
+                    pending.append(await enqueue_with_retry(windows[next_index][1], priority, decoding))
+                    next_index += 1
 
-        return {"prediction": transcription}
+                result = await current
+                own_start, own_end = window_bounds(index, len(windows), offset)
+                window_duration = len(window) / SAMPLING_RATE
+                segments = select_segments(result["chunks"], offset, window_duration, own_start, own_end)
+                for segment in map_segments(segments, speech_map):
+                    texts.append(segment["text"])
+                    yield json.dumps(segment, ensure_ascii=False) + "\n"
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+            log_transcription(' '.join(texts), audio, speech_map, time.perf_counter() - model_started,
+                              'predict-stream')
+            yield json.dumps({"done": True}) + "\n"
+        except Exception as e:
+            ERRORS.labels('stream').inc()
+            logging.error(f'Streaming transcription error: {e}')
+            yield json.dumps({"error": str(e)}, ensure_ascii=False) + "\n"
+        finally:
+            IN_FLIGHT.labels('predict-stream').dec()
+            REQUEST_LATENCY.labels('predict-stream').observe(time.perf_counter() - request_started)
+            # Клиент мог отключиться: не тратим модель на оставшиеся окна
+            for future in pending:
+                future.cancel()
+
+    return StreamingResponse(stream_segments(), media_type="application/x-ndjson")
+
+
+class BulkJobRequest(BaseModel):
+    # Ровно одно из: ключи объектов в S3, префикс в бакете или локальный каталог с аудио внутри BULK_ROOT
+    keys: Optional[List[str]] = None
+    prefix: Optional[str] = None
+    directory: Optional[str] = None
+    max_in_flight: Optional[int] = None
+    # Политика декодирования (greedy/beam), по умолчанию - как у класса приоритета user
+    policy: Optional[str] = None
+
+
+# Пакетное перераспознавание датасета; результаты пишутся в JSONL, прогресс - через GET /jobs/{job_id}
+@app.post("/jobs", status_code=202)
+async def create_bulk_job(request: BulkJobRequest):
+    ensure_ready()
+    try:
+        job = bulk_jobs.create(keys=request.keys, directory=request.directory, prefix=request.prefix,
+                               max_in_flight=request.max_in_flight, policy=request.policy)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return job.progress()
+
+
+@app.get("/jobs")
+async def list_bulk_jobs():
+    return [job.progress() for job in bulk_jobs.jobs.values()]
+
+
+@app.get("/jobs/{job_id}")
+async def get_bulk_job(job_id: str):
+    job = bulk_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.progress()
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_bulk_job(job_id: str):
+    if not bulk_jobs.cancel(job_id):
+        raise HTTPException(status_code=404, detail="No running job with this id")
+    return {"status": "cancelling"}
 
 
 if __name__ == "__main__":
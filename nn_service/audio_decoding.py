@@ -0,0 +1,72 @@
+import io
+
+import numpy as np
+import soundfile as sf
+import soxr
+
+# Частота дискретизации, на которой обучен whisper
+SAMPLING_RATE = 16000
+
+# Типы содержимого, которые считаются "сырым" PCM s16le (моно)
+PCM_CONTENT_TYPES = {'audio/pcm', 'audio/l16', 'audio/x-pcm', 'audio/raw'}
+
+
+class AudioDecodingError(ValueError):
+    pass
+
+
+def _parse_content_type(content_type: str | None) -> tuple[str, dict]:
+    if not content_type:
+        return '', {}
+    mime, *params = [part.strip() for part in content_type.split(';')]
+    options = {}
+    for param in params:
+        if '=' in param:
+            key, value = param.split('=', 1)
+            options[key.strip().lower()] = value.strip()
+    return mime.lower(), options
+
+
+def _to_mono(audio: np.ndarray) -> np.ndarray:
+    if audio.ndim == 2:
+        audio = audio.mean(axis=1)
+    return audio
+
+
+def _resample(audio: np.ndarray, sampling_rate: int) -> np.ndarray:
+    if sampling_rate == SAMPLING_RATE:
+        return audio
+    return soxr.resample(audio, sampling_rate, SAMPLING_RATE)
+
+
+def decode_pcm(data: bytes, sampling_rate: int = SAMPLING_RATE) -> np.ndarray:
+    """Декодирует сырой PCM s16le (моно) в float32 массив 16 кГц."""
+    if len(data) % 2:
+        raise AudioDecodingError('PCM payload length is not a multiple of 2 bytes')
+    audio = np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768.0
+    return _resample(audio, sampling_rate).astype(np.float32, copy=False)
+
+
+def decode_audio(data: bytes, content_type: str | None = None) -> np.ndarray:
+    """Декодирует OGG/Opus, WAV или PCM в памяти в float32 массив 16 кГц, без ffmpeg и временных файлов."""
+    if not data:
+        raise AudioDecodingError('Empty audio payload')
+
+    mime, options = _parse_content_type(content_type)
+    if mime in PCM_CONTENT_TYPES:
+        try:
+            sampling_rate = int(options.get('rate', SAMPLING_RATE))
+        except ValueError:
+            raise AudioDecodingError(f'Invalid PCM rate: {options["rate"]}')
+        if sampling_rate <= 0:
+            raise AudioDecodingError(f'Invalid PCM rate: {sampling_rate}')
+        return decode_pcm(data, sampling_rate)
+
+    # libsndfile сам определяет контейнер (OGG/Opus, OGG/Vorbis, WAV, FLAC) по заголовку
+    try:
+        audio, sampling_rate = sf.read(io.BytesIO(data), dtype='float32', always_2d=True)
+    except (RuntimeError, TypeError) as e:
+        raise AudioDecodingError(f'Unsupported or corrupted audio: {e}')
+
+    audio = _to_mono(audio)
+    return _resample(audio, sampling_rate).astype(np.float32, copy=False)
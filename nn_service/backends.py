@@ -0,0 +1,92 @@
+import logging
+import os
+
+import torch
+from transformers import pipeline, AutoProcessor, WhisperForConditionalGeneration
+
+# Бэкенд инференса: torch-fp32, torch-int8, torch-bf16, onnx, onnx-int8
+ASR_BACKEND = os.getenv('ASR_BACKEND', 'torch-fp32')
+MODEL_PATH = os.getenv('MODEL_PATH', './whisper-small-ru')
+# Артефакты, подготовленные скриптом export_model.py
+ONNX_MODEL_PATH = os.getenv('ONNX_MODEL_PATH', './whisper-small-ru-onnx')
+ONNX_INT8_MODEL_PATH = os.getenv('ONNX_INT8_MODEL_PATH', './whisper-small-ru-onnx-int8')
+
+# Веса читаются из safetensors через mmap прямо в параметры модели, без случайной инициализации
+# и без второй копии в памяти; повторная загрузка после выгрузки берёт страницы из page cache
+MODEL_LOAD_KWARGS = {'use_safetensors': True, 'low_cpu_mem_usage': True}
+
+
+def _asr_pipeline(model, device=None, torch_dtype=None):
+    processor = AutoProcessor.from_pretrained(MODEL_PATH)
+    return pipeline(task="automatic-speech-recognition", model=model, tokenizer=processor.tokenizer,
+                    feature_extractor=processor.feature_extractor, device=device, torch_dtype=torch_dtype)
+
+
+def load_torch_fp32(device):
+    return pipeline(task="automatic-speech-recognition", model=MODEL_PATH, device=device,
+                    model_kwargs=MODEL_LOAD_KWARGS)
+
+
+def load_torch_int8(device):
+    """Динамическая int8-квантизация линейных слоёв, только CPU."""
+    model = WhisperForConditionalGeneration.from_pretrained(MODEL_PATH, **MODEL_LOAD_KWARGS)
+    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return _asr_pipeline(model, device='cpu')
+
+
+def bf16_supported() -> bool:
+    try:
+        return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def load_torch_bf16(device):
+    """bf16 на CPU с поддержкой AVX512-BF16/AMX; на остальных CPU откатываемся к fp32."""
+    if not bf16_supported():
+        logging.warning('CPU does not support bf16, falling back to torch-fp32')
+        return load_torch_fp32(device)
+    model = WhisperForConditionalGeneration.from_pretrained(MODEL_PATH, torch_dtype=torch.bfloat16,
+                                                    **MODEL_LOAD_KWARGS)
+    return _asr_pipeline(model, device='cpu', torch_dtype=torch.bfloat16)
+
+
+def _load_onnx(model_path: str, file_suffix: str = ''):
+    # optimum нужен только ONNX-бэкендам, поэтому импортируем его лениво
+    from optimum.onnxruntime import ORTModelForSpeechSeq2Seq
+
+    model = ORTModelForSpeechSeq2Seq.from_pretrained(
+        model_path,
+        encoder_file_name=f'encoder_model{file_suffix}.onnx',
+        decoder_file_name=f'decoder_model{file_suffix}.onnx',
+        decoder_with_past_file_name=f'decoder_with_past_model{file_suffix}.onnx',
+        provider='CPUExecutionProvider',
+    )
+    return _asr_pipeline(model)
+
+
+def load_onnx(device):
+    return _load_onnx(ONNX_MODEL_PATH)
+
+
+def load_onnx_int8(device):
+    return _load_onnx(ONNX_INT8_MODEL_PATH, file_suffix='_quantized')
+
+
+BACKENDS = {
+    'torch-fp32': load_torch_fp32,
+    'torch-int8': load_torch_int8,
+    'torch-bf16': load_torch_bf16,
+    'onnx': load_onnx,
+    'onnx-int8': load_onnx_int8,
+}
+
+
+def load_pipeline(device, backend: str = ASR_BACKEND):
+    """Создаёт ASR pipeline выбранного бэкенда. Все бэкенды возвращают одинаковый интерфейс pipeline."""
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown ASR_BACKEND: {backend}, available: {", ".join(BACKENDS)}')
+    if backend != 'torch-fp32' and str(device) != 'cpu':
+        logging.warning(f'Backend {backend} runs on CPU only, device {device} is ignored')
+    logging.info(f'Loading ASR backend: {backend}')
+    return BACKENDS[backend](device)
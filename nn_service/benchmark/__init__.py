@@ -0,0 +1,7 @@
+"""Бенчмарк nn_service: задержки, пропускная способность, RTF и пиковый RSS.
+
+Запуск из каталога nn_service:
+    python -m benchmark run --mode inprocess --concurrency 4 --output base.json
+    python -m benchmark run --mode http --url http://localhost:8000/predict --output new.json
+    python -m benchmark compare base.json new.json --threshold 10
+"""
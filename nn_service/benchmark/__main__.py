@@ -0,0 +1,79 @@
+import argparse
+import asyncio
+import json
+import logging
+import sys
+
+from benchmark.corpus import build_corpus, DEFAULT_DURATIONS
+from benchmark.drivers import run_inprocess, run_http
+from benchmark.report import summarize, compare, peak_rss_mb
+
+
+def run(args):
+    corpus = build_corpus(args.durations, args.samples)
+    clips = corpus * args.repeat
+    logging.info(f'Corpus: {len(corpus)} clips, {sum(clip.duration for clip in corpus):.0f} s of audio, '
+                 f'repeat={args.repeat}, concurrency={args.concurrency}')
+
+    warmup = corpus[:1] if args.warmup else []
+    if args.mode == 'inprocess':
+        samples, wall_seconds = asyncio.run(run_inprocess(clips, args.concurrency, warmup))
+    else:
+        samples, wall_seconds = run_http(clips, args.concurrency, args.url, warmup)
+
+    if args.mode == 'inprocess':
+        rss = peak_rss_mb()
+    elif args.server_pid is not None:
+        rss = peak_rss_mb(args.server_pid)
+    else:
+        # RSS самого клиента бенчмарка ничего не говорит о памяти сервиса - метрику не пишем
+        logging.warning('--server-pid is not set, peak_rss_mb is left out of the report')
+        rss = None
+    report = summarize(samples, wall_seconds, args.mode, args.concurrency, rss)
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    print(output)
+    return 0
+
+
+def run_compare(args):
+    with open(args.base) as base_file, open(args.new) as new_file:
+        changes = compare(json.load(base_file), json.load(new_file), args.threshold)
+    print(json.dumps(changes, indent=2))
+    regressions = [change['metric'] for change in changes if change['regression']]
+    if regressions:
+        logging.error(f'Regressions over {args.threshold}%: {", ".join(regressions)}')
+        return 1
+    return 0
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(prog='python -m benchmark', description='nn_service benchmark')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Прогнать корпус и сохранить отчёт в JSON')
+    run_parser.add_argument('--mode', choices=['inprocess', 'http'], default='inprocess')
+    run_parser.add_argument('--url', default='http://localhost:8000/predict')
+    run_parser.add_argument('--server-pid', type=int, default=None,
+                            help='pid сервера для замера пикового RSS в режиме http; без него RSS не замеряется')
+    run_parser.add_argument('--concurrency', type=int, default=4)
+    run_parser.add_argument('--repeat', type=int, default=1)
+    run_parser.add_argument('--durations', type=float, nargs='+', default=DEFAULT_DURATIONS)
+    run_parser.add_argument('--samples', default=None, help='Каталог с реальными голосовыми (wav/ogg)')
+    run_parser.add_argument('--no-warmup', dest='warmup', action='store_false')
+    run_parser.add_argument('--output', default=None)
+
+    compare_parser = commands.add_parser('compare', help='Сравнить два отчёта и найти регрессии')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=10.0, help='Допустимое ухудшение, %%')
+
+    args = parser.parse_args()
+    sys.exit(run(args) if args.command == 'run' else run_compare(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import io
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import soundfile as sf
+
+from audio_decoding import SAMPLING_RATE, decode_audio
+
+# Длительности синтетических клипов по умолчанию, секунды
+DEFAULT_DURATIONS = [2, 5, 10, 30, 60, 120]
+AUDIO_EXTENSIONS = {'.wav', '.ogg', '.oga', '.opus', '.flac'}
+
+
+@dataclass
+class Clip:
+    name: str
+    audio: np.ndarray
+
+    @property
+    def duration(self) -> float:
+        return len(self.audio) / SAMPLING_RATE
+
+    def to_wav(self) -> bytes:
+        buffer = io.BytesIO()
+        sf.write(buffer, self.audio, SAMPLING_RATE, format='WAV', subtype='PCM_16')
+        return buffer.getvalue()
+
+
+def synthetic_clip(duration: float, seed: int) -> np.ndarray:
+    """Речеподобный сигнал: гармоники с плавающим тоном, слоговая модуляция, паузы и шум.
+
+    Детерминирован по seed, чтобы прогоны были сравнимы между собой.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * SAMPLING_RATE)) / SAMPLING_RATE
+    pitch = 140 + 30 * np.sin(2 * np.pi * 0.3 * t + rng.uniform(0, np.pi))
+    phase = 2 * np.pi * np.cumsum(pitch) / SAMPLING_RATE
+    voice = sum(np.sin(k * phase) / k for k in range(1, 6))
+    syllables = 0.5 * (1 + np.sin(2 * np.pi * 4 * t))
+
+    # Паузы по 0.3-1.5 с примерно раз в 3 секунды
+    gate = np.ones_like(t)
+    position = 0.0
+    while position < duration:
+        position += rng.uniform(2, 4)
+        pause = rng.uniform(0.3, 1.5)
+        gate[(t >= position) & (t < position + pause)] = 0
+        position += pause
+
+    audio = 0.2 * voice * syllables * gate + rng.normal(0, 0.005, len(t))
+    return audio.astype(np.float32)
+
+
+def build_corpus(durations: List[float] = DEFAULT_DURATIONS, samples_dir: str | None = None) -> List[Clip]:
+    """Синтетические клипы заданных длительностей плюс реальные записи из samples_dir, если он указан."""
+    clips = [Clip(name=f'synthetic_{duration:g}s', audio=synthetic_clip(duration, seed=index))
+             for index, duration in enumerate(durations)]
+
+    if samples_dir:
+        for path in sorted(Path(samples_dir).rglob('*')):
+            if path.suffix.lower() in AUDIO_EXTENSIONS:
+                clips.append(Clip(name=path.name, audio=decode_audio(path.read_bytes())))
+    return clips
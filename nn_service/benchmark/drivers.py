@@ -0,0 +1,98 @@
+import asyncio
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List
+
+from benchmark.corpus import Clip
+
+
+@dataclass
+class Sample:
+    clip: str
+    duration: float
+    latency: float
+    error: str | None = None
+
+
+async def run_inprocess(clips: List[Clip], concurrency: int,
+                        warmup: List[Clip]) -> tuple[List[Sample], float]:
+    """Гоняет клипы через модель и планировщик батчей в текущем процессе, без HTTP.
+
+    Возвращает замеры и время прогона (без загрузки модели и прогрева).
+    """
+    # Импортируем здесь: загрузка api_model создаёт планировщик и менеджер модели
+    import api_model
+
+    await asyncio.to_thread(api_model.model.start)
+    await api_model.scheduler.start()
+    try:
+        for clip in warmup:
+            await api_model.scheduler.submit(clip.audio)
+
+        started = time.perf_counter()
+        samples = await _drive_scheduler(api_model.scheduler, clips, concurrency)
+        return samples, time.perf_counter() - started
+    finally:
+        await api_model.scheduler.stop()
+
+
+async def _drive_scheduler(scheduler, clips: List[Clip], concurrency: int) -> List[Sample]:
+    queue: asyncio.Queue = asyncio.Queue()
+    for clip in clips:
+        queue.put_nowait(clip)
+    samples = []
+
+    async def worker():
+        while not queue.empty():
+            clip = queue.get_nowait()
+            started = time.perf_counter()
+            error = None
+            try:
+                await scheduler.submit(clip.audio)
+            except Exception as e:
+                error = type(e).__name__
+            samples.append(Sample(clip.name, clip.duration, time.perf_counter() - started, error))
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return samples
+
+
+def _multipart(field: str, filename: str, data: bytes, content_type: str) -> tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n').encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def _post_clip(url: str, clip: Clip, payload: bytes, timeout: float) -> Sample:
+    body, content_type = _multipart('file', f'{clip.name}.wav', payload, 'audio/wav')
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': content_type}, method='POST')
+    started = time.perf_counter()
+    error = None
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+    except urllib.error.HTTPError as e:
+        error = f'http_{e.code}'
+    except (urllib.error.URLError, TimeoutError) as e:
+        error = type(e).__name__
+    return Sample(clip.name, clip.duration, time.perf_counter() - started, error)
+
+
+def run_http(clips: List[Clip], concurrency: int, url: str, warmup: List[Clip],
+             timeout: float = 600) -> tuple[List[Sample], float]:
+    """Отправляет клипы на HTTP эндпоинт /predict с заданным числом параллельных клиентов."""
+    for clip in warmup:
+        _post_clip(url, clip, clip.to_wav(), timeout)
+
+    # WAV кодируем заранее, чтобы не мерить кодирование вместо сервиса
+    payloads = [clip.to_wav() for clip in clips]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(lambda item: _post_clip(url, item[0], item[1], timeout), zip(clips, payloads)))
+    return samples, time.perf_counter() - started
@@ -0,0 +1,74 @@
+import os
+import resource
+from typing import List
+
+import numpy as np
+
+from benchmark.drivers import Sample
+
+# Метрики, для которых рост - это регрессия; для остальных регрессия - падение
+LOWER_IS_BETTER = {'latency_p50_ms', 'latency_p95_ms', 'latency_p99_ms', 'peak_rss_mb', 'error_rate'}
+HIGHER_IS_BETTER = {'requests_per_second', 'audio_seconds_per_second'}
+
+# Переменные окружения сервиса, которые влияют на производительность и попадают в отчёт
+CONFIG_ENV = ['ASR_BACKEND', 'MAX_BATCH_SIZE', 'MAX_WAIT_MS', 'INFERENCE_WORKERS', 'PREFORK_WORKERS',
+              'LONG_FORM_MODE', 'CHUNK_BATCH_SIZE', 'VAD_ENABLED']
+
+
+def peak_rss_mb(pid: int | None = None) -> float:
+    """Пиковый RSS процесса: текущего или, для HTTP-режима, процесса сервера по pid."""
+    if pid is None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def summarize(samples: List[Sample], wall_seconds: float, mode: str, concurrency: int,
+              rss_mb: float | None) -> dict:
+    ok = [sample for sample in samples if sample.error is None]
+    latencies = np.array([sample.latency for sample in ok]) * 1000
+    errors = {}
+    for sample in samples:
+        if sample.error:
+            errors[sample.error] = errors.get(sample.error, 0) + 1
+
+    def percentile(q):
+        return round(float(np.percentile(latencies, q)), 1) if len(latencies) else None
+
+    return {
+        'mode': mode,
+        'concurrency': concurrency,
+        'config': {name: os.environ[name] for name in CONFIG_ENV if name in os.environ},
+        'requests': len(samples),
+        'errors': errors,
+        'error_rate': round(1 - len(ok) / len(samples), 4) if samples else 0.0,
+        'wall_seconds': round(wall_seconds, 3),
+        'audio_seconds': round(sum(sample.duration for sample in ok), 1),
+        'latency_p50_ms': percentile(50),
+        'latency_p95_ms': percentile(95),
+        'latency_p99_ms': percentile(99),
+        'requests_per_second': round(len(ok) / wall_seconds, 3) if wall_seconds else None,
+        'audio_seconds_per_second': round(sum(sample.duration for sample in ok) / wall_seconds, 3)
+        if wall_seconds else None,
+        'peak_rss_mb': round(rss_mb, 1) if rss_mb is not None else None,
+    }
+
+
+def compare(base: dict, new: dict, threshold_percent: float) -> List[dict]:
+    """Сравнивает два отчёта, возвращает изменения метрик с пометкой регрессий."""
+    changes = []
+    for metric in sorted(LOWER_IS_BETTER | HIGHER_IS_BETTER):
+        old_value, new_value = base.get(metric), new.get(metric)
+        if old_value is None or new_value is None:
+            continue
+        if old_value == 0:
+            delta = 0.0 if new_value == 0 else float('inf')
+        else:
+            delta = (new_value - old_value) / abs(old_value) * 100
+        worse = delta > threshold_percent if metric in LOWER_IS_BETTER else delta < -threshold_percent
+        changes.append({'metric': metric, 'base': old_value, 'new': new_value,
+                        'change_percent': round(delta, 1), 'regression': worse})
+    return changes
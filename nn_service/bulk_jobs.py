@@ -0,0 +1,278 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import AsyncIterator, Dict, List
+
+from audio_decoding import decode_audio, SAMPLING_RATE
+from decoding import resolve_policy
+from inference_scheduler import QueueFullError
+from vad import apply_vad, VAD_ENABLED
+
+# Каталог с состоянием и результатами пакетных задач (должен переживать перезапуск контейнера)
+BULK_JOBS_DIR = os.getenv('BULK_JOBS_DIR', './bulk_jobs')
+# Локальные каталоги задач должны лежать внутри этого каталога; относительный путь отсчитывается от него
+BULK_ROOT = os.getenv('BULK_ROOT', './datasets')
+# Сколько файлов одной задачи одновременно находится в очереди инференса
+BULK_MAX_IN_FLIGHT = int(os.getenv('BULK_MAX_IN_FLIGHT', '4'))
+# Пока в очереди больше живых запросов, чем этот порог, пакетная задача не добавляет новые файлы
+BULK_YIELD_QUEUE_SIZE = int(os.getenv('BULK_YIELD_QUEUE_SIZE', '4'))
+# Приоритет ниже, чем у любого пользователя бота
+BULK_PRIORITY = -1
+AUDIO_EXTENSIONS = ('.wav', '.ogg', '.oga', '.opus', '.flac')
+S3_AUDIO_SUFFIX = '_audio.wav'
+
+
+@dataclass
+class BulkJob:
+    job_id: str
+    keys: List[str] | None = None
+    directory: str | None = None
+    prefix: str | None = None
+    max_in_flight: int = BULK_MAX_IN_FLIGHT
+    policy: str | None = None
+    status: str = 'pending'
+    total: int | None = None
+    done: int = 0
+    failed: int = 0
+    audio_seconds: float = 0.0
+    created_at: float = field(default_factory=time.time)
+    finished_at: float | None = None
+    error: str | None = None
+
+    @property
+    def path(self) -> Path:
+        return Path(BULK_JOBS_DIR) / self.job_id
+
+    @property
+    def results_path(self) -> Path:
+        return self.path / 'results.jsonl'
+
+    def save(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path / 'job.json.tmp'
+        temp_path.write_text(json.dumps(asdict(self), ensure_ascii=False))
+        os.replace(temp_path, self.path / 'job.json')
+
+    def progress(self) -> dict:
+        return {**asdict(self), 'results': str(self.results_path)}
+
+
+def _s3_client():
+    from minio import Minio
+
+    return Minio(os.environ['S3_ADDRESS'], access_key=os.environ['ACCESS_KEY'],
+                 secret_key=os.environ['SECRET_KEY'], secure=False)
+
+
+def _read_s3_object(client, key: str) -> bytes:
+    response = client.get_object(os.environ['BUCKET_NAME'], key)
+    try:
+        return response.read()
+    finally:
+        response.close()
+        response.release_conn()
+
+
+class BulkJobManager:
+    """Фоновые задачи перераспознавания датасета: S3 ключи или локальный каталог -> JSONL."""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.jobs: Dict[str, BulkJob] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._cancelled = set()
+        self._s3 = None
+
+    def create(self, keys: List[str] | None = None, directory: str | None = None, prefix: str | None = None,
+               max_in_flight: int | None = None, policy: str | None = None) -> BulkJob:
+        if sum(source is not None for source in (keys, directory, prefix)) != 1:
+            raise ValueError('Exactly one of keys, directory or prefix must be set')
+        if directory is not None:
+            directory = str(_resolve_directory(directory))
+        resolve_policy(policy, 0)
+
+        job = BulkJob(job_id=uuid.uuid4().hex[:12], keys=keys, directory=directory, prefix=prefix,
+                      max_in_flight=max(1, max_in_flight or BULK_MAX_IN_FLIGHT), policy=policy)
+        job.save()
+        self._start(job)
+        return job
+
+    def get(self, job_id: str) -> BulkJob | None:
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        task = self._tasks.get(job_id)
+        if task is None or task.done():
+            return False
+        self._cancelled.add(job_id)
+        task.cancel()
+        return True
+
+    def resume_all(self):
+        """Подхватывает задачи, прерванные перезапуском сервиса; готовые файлы повторно не обрабатываются."""
+        for job_file in sorted(Path(BULK_JOBS_DIR).glob('*/job.json')):
+            job = BulkJob(**json.loads(job_file.read_text()))
+            self.jobs[job.job_id] = job
+            if job.status in ('pending', 'running'):
+                logging.info(f'Resuming bulk job {job.job_id}')
+                self._start(job)
+
+    async def stop(self):
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    def _start(self, job: BulkJob):
+        self.jobs[job.job_id] = job
+        self._tasks[job.job_id] = asyncio.create_task(self._run(job))
+
+    async def _list_items(self, job: BulkJob) -> List[str]:
+        if job.keys is not None:
+            return job.keys
+        if job.directory is not None:
+            root = _resolve_directory(job.directory)
+            # Ссылки, ведущие за пределы BULK_ROOT, не читаем
+            return [str(path) for path in sorted(root.rglob('*'))
+                    if path.suffix.lower() in AUDIO_EXTENSIONS and _inside_root(path)]
+
+        def list_bucket():
+            objects = self._get_s3().list_objects(os.environ['BUCKET_NAME'], prefix=job.prefix, recursive=True)
+            return [obj.object_name for obj in objects if obj.object_name.endswith(S3_AUDIO_SUFFIX)]
+
+        return await asyncio.to_thread(list_bucket)
+
+    def _get_s3(self):
+        if self._s3 is None:
+            self._s3 = _s3_client()
+        return self._s3
+
+    async def _read(self, job: BulkJob, item: str) -> bytes:
+        if job.directory is not None:
+            return await asyncio.to_thread(Path(item).read_bytes)
+        return await asyncio.to_thread(_read_s3_object, self._get_s3(), item)
+
+    async def _transcribe(self, job: BulkJob, item: str) -> dict:
+        # Декодирование и VAD - проходы по всему файлу, вне event loop
+        audio, speech = await asyncio.to_thread(_decode, await self._read(job, item))
+        duration = len(audio) / SAMPLING_RATE
+        if not len(speech):
+            return {'key': item, 'prediction': '', 'duration': round(duration, 2)}
+
+        # Для датасета нужен только текст, метки времени не генерируем
+        decoding = resolve_policy(job.policy, 0, timestamps=False)
+        # Уступаем очередь живому трафику; свои же файлы задачи в счёт не идут
+        while self.scheduler.queued_above(BULK_PRIORITY) >= BULK_YIELD_QUEUE_SIZE:
+            await asyncio.sleep(0.5)
+        while True:
+            try:
+                result = await self.scheduler.submit(speech, BULK_PRIORITY, len(speech) / SAMPLING_RATE, decoding)
+                break
+            except QueueFullError as e:
+                # Переполнение очереди - не ошибка файла, просто ждём
+                await asyncio.sleep(e.retry_after)
+        return {'key': item, 'prediction': result['text'], 'duration': round(duration, 2)}
+
+    async def _run(self, job: BulkJob):
+        try:
+            items = await self._list_items(job)
+            completed = _load_completed(job.results_path)
+            job.status, job.total, job.failed = 'running', len(items), 0
+            job.done = sum(1 for item in items if item in completed)
+            job.audio_seconds = sum(completed[item]['duration'] for item in items if item in completed)
+            job.save()
+
+            async for result in self._process(job, [item for item in items if item not in completed]):
+                with open(job.results_path, 'a', encoding='utf-8') as results:
+                    results.write(json.dumps(result, ensure_ascii=False) + '\n')
+                job.done += 1
+                if 'error' in result:
+                    job.failed += 1
+                else:
+                    job.audio_seconds += result['duration']
+                if job.done % 50 == 0:
+                    job.save()
+
+            job.status = 'finished'
+            logging.info(f'Bulk job {job.job_id} finished: {job.done} files, {job.failed} failed')
+        except asyncio.CancelledError:
+            # Остановка сервиса оставляет задачу в running, чтобы она продолжилась после старта
+            if job.job_id in self._cancelled:
+                job.status = 'cancelled'
+            raise
+        except Exception as e:
+            job.status, job.error = 'failed', str(e)
+            logging.error(f'Bulk job {job.job_id} failed: {e}')
+        finally:
+            if job.status != 'running':
+                job.finished_at = time.time()
+            job.save()
+
+    async def _process(self, job: BulkJob, items: List[str]) -> AsyncIterator[dict]:
+        """Обрабатывает файлы не более чем по max_in_flight одновременно, отдаёт результаты по готовности."""
+        queue: asyncio.Queue = asyncio.Queue()
+        iterator = iter(items)
+
+        async def worker():
+            for item in iterator:
+                try:
+                    result = await self._transcribe(job, item)
+                except Exception as e:
+                    logging.error(f'Bulk job {job.job_id}: {item} failed: {e}')
+                    result = {'key': item, 'error': str(e)}
+                await queue.put(result)
+
+        workers = [asyncio.create_task(worker()) for _ in range(job.max_in_flight)]
+        try:
+            for _ in range(len(items)):
+                yield await queue.get()
+        finally:
+            for task in workers:
+                task.cancel()
+
+
+def _decode(data: bytes) -> tuple:
+    audio = decode_audio(data)
+    return audio, apply_vad(audio)[0] if VAD_ENABLED else audio
+
+
+def _inside_root(path: Path) -> bool:
+    return path.resolve().is_relative_to(Path(BULK_ROOT).resolve())
+
+
+def _resolve_directory(directory: str) -> Path:
+    """Каталог задачи внутри BULK_ROOT; пути за его пределами (/, ../) отклоняются."""
+    path = (Path(BULK_ROOT) / directory).resolve()
+    if not _inside_root(path):
+        raise ValueError(f'Directory must be inside BULK_ROOT: {directory}')
+    if not path.is_dir():
+        raise ValueError(f'Directory not found: {directory}')
+    return path
+
+
+def _load_completed(results_path: Path) -> Dict[str, dict]:
+    """Успешные результаты, уже записанные в JSONL. Файл переписывается без неудачных и оборванных строк:
+    неудачные файлы при возобновлении обрабатываются заново."""
+    if not results_path.exists():
+        return {}
+    completed = {}
+    with open(results_path, encoding='utf-8') as results:
+        for line in results:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Последняя строка могла оборваться при падении процесса
+                continue
+            if 'error' not in record:
+                completed[record['key']] = record
+
+    temp_path = results_path.with_suffix('.tmp')
+    with open(temp_path, 'w', encoding='utf-8') as results:
+        for record in completed.values():
+            results.write(json.dumps(record, ensure_ascii=False) + '\n')
+    os.replace(temp_path, results_path)
+    return completed
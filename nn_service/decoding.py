@@ -0,0 +1,50 @@
+import math
+import os
+from dataclasses import dataclass
+
+# Язык и задача фиксированы: автоопределение языка - лишний проход декодера на каждый запрос
+DECODING_LANGUAGE = os.getenv('DECODING_LANGUAGE', 'ru')
+DECODING_TASK = 'transcribe'
+BEAM_SIZE = int(os.getenv('BEAM_SIZE', '4'))
+# Политика по умолчанию для классов приоритета 0 - user, 1 - beta-tester, 2 - unlimited, 3 - admin
+DECODING_POLICY_BY_PRIORITY = os.getenv('DECODING_POLICY_BY_PRIORITY', 'greedy,greedy,beam,beam').split(',')
+# Бюджет токенов растёт с длительностью аудио, чтобы зациклившийся декодер не доходил до предела модели
+MAX_TOKENS_BASE = int(os.getenv('MAX_TOKENS_BASE', '16'))
+MAX_TOKENS_PER_SECOND = float(os.getenv('MAX_TOKENS_PER_SECOND', '10'))
+# Декодер whisper держит 448 позиций, часть из них занимают служебные токены промпта
+MAX_NEW_TOKENS_CAP = 440
+# Whisper декодирует окнами по 30 секунд, бюджет считается на окно
+WINDOW_SECONDS = 30.0
+
+POLICIES = {'greedy': 1, 'beam': BEAM_SIZE}
+
+
+@dataclass(frozen=True)
+class DecodingPolicy:
+    """Настройки генерации, общие для всех запросов батча."""
+    num_beams: int = 1
+    timestamps: bool = True
+
+
+def resolve_policy(name: str | None, priority: int, timestamps: bool = True) -> DecodingPolicy:
+    """Политика по имени из запроса, а если оно не задано - по классу приоритета."""
+    if not name:
+        name = DECODING_POLICY_BY_PRIORITY[min(max(priority, 0), len(DECODING_POLICY_BY_PRIORITY) - 1)]
+    if name not in POLICIES:
+        raise ValueError(f'Unknown decoding policy: {name}, expected one of {", ".join(POLICIES)}')
+    return DecodingPolicy(num_beams=POLICIES[name], timestamps=timestamps)
+
+
+def max_new_tokens(seconds: float) -> int:
+    seconds = min(seconds, WINDOW_SECONDS)
+    return min(MAX_NEW_TOKENS_CAP, math.ceil(MAX_TOKENS_BASE + MAX_TOKENS_PER_SECOND * seconds))
+
+
+def generate_kwargs(policy: DecodingPolicy, seconds: float) -> dict:
+    """Аргументы generate для батча, seconds - длительность самого длинного аудио в нём."""
+    return {
+        'language': DECODING_LANGUAGE,
+        'task': DECODING_TASK,
+        'num_beams': policy.num_beams,
+        'max_new_tokens': max_new_tokens(seconds),
+    }
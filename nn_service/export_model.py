@@ -0,0 +1,68 @@
+"""Готовит оптимизированные артефакты модели для бэкендов onnx и onnx-int8 (см. backends.py).
+
+Пример:
+    python export_model.py --model ./whisper-small-ru --output ./whisper-small-ru-onnx \
+        --int8-output ./whisper-small-ru-onnx-int8
+"""
+import argparse
+import logging
+import shutil
+from pathlib import Path
+
+from optimum.onnxruntime import ORTModelForSpeechSeq2Seq, ORTQuantizer
+from optimum.onnxruntime.configuration import AutoQuantizationConfig
+from transformers import AutoProcessor, GenerationConfig
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+QUANTIZATION_CONFIGS = {
+    'avx2': lambda: AutoQuantizationConfig.avx2(is_static=False, per_channel=False),
+    'avx512': lambda: AutoQuantizationConfig.avx512(is_static=False, per_channel=False),
+    'avx512_vnni': lambda: AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False),
+    'arm64': lambda: AutoQuantizationConfig.arm64(is_static=False, per_channel=False),
+}
+
+
+def export_onnx(model_path: str, output_path: str):
+    """Экспортирует энкодер и декодер whisper в ONNX вместе с процессором и конфигом генерации."""
+    logging.info(f'Exporting {model_path} to ONNX: {output_path}')
+    model = ORTModelForSpeechSeq2Seq.from_pretrained(model_path, export=True, use_merged=False)
+    model.save_pretrained(output_path)
+    AutoProcessor.from_pretrained(model_path).save_pretrained(output_path)
+    GenerationConfig.from_pretrained(model_path).save_pretrained(output_path)
+
+
+def quantize_onnx(onnx_path: str, output_path: str, target: str):
+    """Динамическая int8-квантизация всех ONNX-графов модели."""
+    quantization_config = QUANTIZATION_CONFIGS[target]()
+    output = Path(output_path)
+    output.mkdir(parents=True, exist_ok=True)
+
+    for onnx_file in sorted(Path(onnx_path).glob('*.onnx')):
+        logging.info(f'Quantizing {onnx_file.name} ({target})')
+        quantizer = ORTQuantizer.from_pretrained(onnx_path, file_name=onnx_file.name)
+        quantizer.quantize(save_dir=output, quantization_config=quantization_config)
+
+    # Конфиги, токенизатор и препроцессор нужны рядом с квантованными графами
+    for extra_file in Path(onnx_path).iterdir():
+        if extra_file.is_file() and extra_file.suffix != '.onnx':
+            shutil.copy(extra_file, output / extra_file.name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export whisper-small-ru to ONNX Runtime artifacts')
+    parser.add_argument('--model', default='./whisper-small-ru')
+    parser.add_argument('--output', default='./whisper-small-ru-onnx')
+    parser.add_argument('--int8-output', default=None,
+                        help='Куда сохранить int8-квантованную копию (бэкенд onnx-int8)')
+    parser.add_argument('--int8-target', default='avx2', choices=sorted(QUANTIZATION_CONFIGS))
+    args = parser.parse_args()
+
+    export_onnx(args.model, args.output)
+    if args.int8_output:
+        quantize_onnx(args.output, args.int8_output, args.int8_target)
+    logging.info('Export finished')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+import asyncio
+import bisect
+import logging
+import math
+import os
+from concurrent.futures import BrokenExecutor, Executor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Hashable, List
+
+from metrics import BATCH_LATENCY, BATCH_SIZE, QUEUE_WAIT
+
+# Настройки динамического батчинга
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', '8'))
+MAX_WAIT_MS = float(os.getenv('MAX_WAIT_MS', '20'))
+
+# Количество потоков инференса и максимальная длина очереди ожидания (0 - без ограничения)
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', '1'))
+MAX_QUEUE_SIZE = int(os.getenv('MAX_QUEUE_SIZE', '64'))
+
+# Границы корзин по длительности аудио (секунды): в один батч попадают задачи из одной корзины
+LENGTH_BUCKETS = [float(bound) for bound in os.getenv('LENGTH_BUCKETS', '5,10,20,30,60,120,300').split(',')]
+# Защита от голодания: каждые AGING_SECONDS ожидания поднимают класс приоритета задачи на единицу
+AGING_SECONDS = float(os.getenv('AGING_SECONDS', '10'))
+
+
+class QueueFullError(Exception):
+    """Очередь инференса переполнена, запрос нужно повторить позже."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f'Inference queue is full, retry after {retry_after} s')
+        self.retry_after = retry_after
+
+
+@dataclass
+class InferenceJob:
+    payload: Any
+    future: asyncio.Future = field(repr=False)
+    enqueued_at: float = 0.0
+    # Класс приоритета (чем больше, тем раньше) и длительность аудио в секундах
+    priority: int = 0
+    duration: float = 0.0
+    # Задачи с разными группами (например, настройками декодирования) в один батч не попадают
+    group: Hashable = None
+
+    @property
+    def bucket(self) -> int:
+        return bisect.bisect_left(LENGTH_BUCKETS, self.duration)
+
+    @property
+    def batch_key(self) -> tuple:
+        return self.bucket, self.group
+
+
+class InferenceScheduler:
+    """Собирает входящие запросы в батчи и прогоняет их через модель.
+
+    Следующий батч начинается с задачи с наибольшим приоритетом с учётом времени ожидания,
+    при равном приоритете - с более короткой; батч добирается задачами из той же корзины длительности
+    и той же группы.
+    """
+
+    def __init__(self, infer_batch: Callable[[List[Any], Hashable], List[Any]],
+                 max_batch_size: int = MAX_BATCH_SIZE, max_wait_ms: float = MAX_WAIT_MS,
+                 workers: int = INFERENCE_WORKERS, max_queue_size: int = MAX_QUEUE_SIZE):
+        # infer_batch - синхронная функция: (список входов, группа батча) -> список результатов в том же порядке
+        self.infer_batch = infer_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.workers = max(1, workers)
+        self.max_queue_size = max(0, max_queue_size)
+        self._pending: List[InferenceJob] = []
+        self._changed = asyncio.Event()
+        self._executor: Executor | None = None
+        self._restart_executor: Callable[[], Awaitable[Executor]] | None = None
+        # Пока сломанный пул заменяется, циклы батчинга не отправляют в него задачи
+        self._executor_lock = asyncio.Lock()
+        self._tasks: List[asyncio.Task] = []
+        # Скользящее среднее времени обработки батча, для оценки Retry-After
+        self._batch_seconds = 1.0
+
+    @property
+    def queue_size(self) -> int:
+        return len(self._pending)
+
+    async def start(self, executor: Executor | None = None,
+                    restart_executor: Callable[[], Awaitable[Executor]] | None = None):
+        """Запускает циклы батчинга. Без executor создаётся пул потоков на self.workers потоков.
+        restart_executor возвращает новый пул взамен сломанного (например, умер процесс пула prefork)."""
+        if self._tasks:
+            return
+        self._restart_executor = restart_executor
+        # Инференс выполняется в отдельном ограниченном пуле, а не в event loop
+        self._executor = executor or ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='inference')
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+        logging.info(f'Inference scheduler started: max_batch_size={self.max_batch_size}, '
+                     f'max_wait_ms={self.max_wait * 1000:.0f}, workers={self.workers}, '
+                     f'max_queue_size={self.max_queue_size}')
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _replace_executor(self, broken: Executor):
+        async with self._executor_lock:
+            # Пул мог уже заменить другой цикл батчинга
+            if self._executor is not broken:
+                return
+            broken.shutdown(wait=False, cancel_futures=True)
+            if self._restart_executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='inference')
+                return
+            try:
+                self._executor = await self._restart_executor()
+            except Exception as e:
+                logging.error(f'Inference executor restart failed: {e}')
+                return
+            logging.info('Inference executor restarted')
+
+    def queued_above(self, priority: int) -> int:
+        """Сколько ожидающих задач с приоритетом выше priority."""
+        return sum(1 for job in self._pending if job.priority > priority and not job.future.cancelled())
+
+    def retry_after(self) -> int:
+        """Оценка в секундах, через сколько очередь успеет разгрузиться."""
+        batches_ahead = len(self._pending) / (self.max_batch_size * self.workers)
+        return max(1, math.ceil(batches_ahead * self._batch_seconds))
+
+    def enqueue(self, payload: Any, priority: int = 0, duration: float = 0.0,
+                group: Hashable = None) -> asyncio.Future:
+        """Ставит вход в очередь и возвращает future с результатом его батча.
+
+        Если очередь заполнена, сразу выбрасывает QueueFullError, а не копит соединения.
+        """
+        if self.max_queue_size and len(self._pending) >= self.max_queue_size:
+            # Клиенты могли отключиться, их задачи место не занимают
+            self._pending = [job for job in self._pending if not job.future.cancelled()]
+            if len(self._pending) >= self.max_queue_size:
+                raise QueueFullError(self.retry_after())
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append(InferenceJob(payload=payload, future=future, enqueued_at=loop.time(),
+                                          priority=priority, duration=duration, group=group))
+        self._changed.set()
+        return future
+
+    async def submit(self, payload: Any, priority: int = 0, duration: float = 0.0, group: Hashable = None) -> Any:
+        """Ставит вход в очередь и ждёт результат его батча."""
+        return await self.enqueue(payload, priority, duration, group)
+
+    async def _wait_for_change(self, timeout: float | None = None) -> bool:
+        self._changed.clear()
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _take_batch(self) -> List[InferenceJob]:
+        """Забирает из очереди следующий батч согласно приоритетам, корзинам длительности и группам."""
+        self._pending = [job for job in self._pending if not job.future.cancelled()]
+        if not self._pending:
+            return []
+
+        now = asyncio.get_running_loop().time()
+
+        def order(job: InferenceJob):
+            effective_priority = job.priority + int((now - job.enqueued_at) // AGING_SECONDS)
+            return -effective_priority, job.bucket, job.enqueued_at
+
+        candidates = sorted(self._pending, key=order)
+        head = candidates[0]
+        batch = [job for job in candidates if job.batch_key == head.batch_key][:self.max_batch_size]
+
+        taken = {id(job) for job in batch}
+        self._pending = [job for job in self._pending if id(job) not in taken]
+        return batch
+
+    async def _collect_batch(self) -> List[InferenceJob]:
+        loop = asyncio.get_running_loop()
+
+        # Ждём первый запрос без ограничения по времени
+        while not self._pending:
+            await self._wait_for_change()
+        deadline = loop.time() + self.max_wait
+
+        # Даём батчу добраться, пока не наберём max_batch_size или не истечёт max_wait
+        while len(self._pending) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0 or not await self._wait_for_change(timeout):
+                break
+
+        return self._take_batch()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect_batch()
+
+            # Клиент мог отключиться, пока запрос ждал в очереди
+            batch = [job for job in batch if not job.future.cancelled()]
+            if not batch:
+                continue
+
+            started = loop.time()
+            for job in batch:
+                QUEUE_WAIT.observe(started - job.enqueued_at)
+            async with self._executor_lock:
+                executor = self._executor
+            try:
+                results = await loop.run_in_executor(executor, self.infer_batch,
+                                                     [job.payload for job in batch], batch[0].group)
+            except BrokenExecutor as e:
+                logging.error(f'Inference executor is broken: {e}')
+                for job in batch:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                await self._replace_executor(executor)
+                continue
+            except Exception as e:
+                logging.error(f'Batch inference error: {e}')
+                for job in batch:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                continue
+
+            elapsed = loop.time() - started
+            self._batch_seconds = 0.8 * self._batch_seconds + 0.2 * elapsed
+            BATCH_LATENCY.observe(elapsed)
+            BATCH_SIZE.observe(len(batch))
+            logging.info(f'Processed batch of {len(batch)} requests in {elapsed:.2f} s')
+            for job, result in zip(batch, results):
+                if not job.future.done():
+                    job.future.set_result(result)
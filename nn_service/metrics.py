@@ -0,0 +1,40 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Метрики сервиса для эндпоинта /metrics (формат Prometheus).
+# Всё, кроме инференса, считается в основном процессе, поэтому режим prefork не требует multiprocess-сборщика.
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+
+REQUEST_LATENCY = Histogram('nn_request_duration_seconds', 'Полное время обработки запроса',
+                            ['endpoint'], buckets=LATENCY_BUCKETS)
+DECODE_LATENCY = Histogram('nn_audio_decode_seconds', 'Время декодирования аудио (и VAD)',
+                           buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2))
+MODEL_LATENCY = Histogram('nn_model_seconds', 'Время от постановки в очередь до результата модели',
+                          ['endpoint'], buckets=LATENCY_BUCKETS)
+QUEUE_WAIT = Histogram('nn_queue_wait_seconds', 'Время ожидания запроса в очереди до начала батча',
+                       buckets=LATENCY_BUCKETS)
+BATCH_LATENCY = Histogram('nn_batch_inference_seconds', 'Время прогона одного батча через модель',
+                          buckets=LATENCY_BUCKETS)
+BATCH_SIZE = Histogram('nn_batch_size', 'Количество запросов в батче', buckets=(1, 2, 4, 8, 16, 32, 64))
+
+AUDIO_DURATION = Histogram('nn_audio_duration_seconds', 'Длительность аудио в запросе',
+                           buckets=(1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1200))
+AUDIO_PROCESSED = Counter('nn_audio_processed_seconds_total', 'Суммарная длительность обработанного аудио')
+VAD_TRIMMED = Counter('nn_vad_trimmed_seconds_total', 'Секунды тишины, вырезанные VAD до модели')
+REAL_TIME_FACTOR = Histogram('nn_real_time_factor', 'Время модели, делённое на длительность аудио',
+                             buckets=(0.01, 0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 2, 5))
+
+IN_FLIGHT = Gauge('nn_requests_in_flight', 'Запросы в обработке', ['endpoint'])
+QUEUED = Gauge('nn_queued_requests', 'Запросы, ожидающие в очереди инференса')
+
+ERRORS = Counter('nn_errors_total', 'Ошибки по типам', ['type'])
+
+
+def observe_audio(duration: float, trimmed: float, model_seconds: float, endpoint: str):
+    """Метрики одного успешно обработанного аудио."""
+    AUDIO_DURATION.observe(duration)
+    AUDIO_PROCESSED.inc(duration)
+    VAD_TRIMMED.inc(trimmed)
+    MODEL_LATENCY.labels(endpoint).observe(model_seconds)
+    if duration > 0:
+        REAL_TIME_FACTOR.observe(model_seconds / duration)
@@ -0,0 +1,98 @@
+import asyncio
+import gc
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable
+
+import numpy as np
+
+from audio_decoding import SAMPLING_RATE
+from decoding import DecodingPolicy, generate_kwargs
+
+# Прогон синтетического аудио после загрузки, чтобы первый запрос не платил за прогрев ядер
+WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', '1') == '1'
+# Через сколько секунд простоя выгружать модель из памяти (0 - никогда)
+IDLE_UNLOAD_SECONDS = float(os.getenv('IDLE_UNLOAD_SECONDS', '0'))
+
+
+def synthetic_audio(seconds: float = 1.0) -> np.ndarray:
+    """Тихий тон с шумом: достаточно, чтобы прогнать энкодер и несколько шагов декодера."""
+    t = np.arange(int(seconds * SAMPLING_RATE)) / SAMPLING_RATE
+    noise = np.random.default_rng(0).normal(0, 0.01, len(t))
+    return (0.1 * np.sin(2 * np.pi * 220 * t) + noise).astype(np.float32)
+
+
+class ModelManager:
+    """Отвечает за жизненный цикл pipeline: загрузка, прогрев, готовность и выгрузка при простое."""
+
+    def __init__(self, loader: Callable[[], Any], warmup: bool = WARMUP_ENABLED,
+                 idle_unload_seconds: float = IDLE_UNLOAD_SECONDS):
+        self.loader = loader
+        self.warmup_enabled = warmup
+        self.idle_unload_seconds = idle_unload_seconds
+        self.ready = False
+        self._pipe = None
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._last_used = time.monotonic()
+
+    @property
+    def loaded(self) -> bool:
+        return self._pipe is not None
+
+    def load(self):
+        with self._lock:
+            if self._pipe is None:
+                started = time.monotonic()
+                self._pipe = self.loader()
+                logging.info(f'Model loaded in {time.monotonic() - started:.2f} s')
+            return self._pipe
+
+    def warmup(self):
+        if not self.warmup_enabled:
+            return
+        started = time.monotonic()
+        with self.acquire() as pipe:
+            # Те же настройки генерации, что и у запросов по умолчанию
+            pipe(synthetic_audio(), return_timestamps=True, generate_kwargs=generate_kwargs(DecodingPolicy(), 1.0))
+        logging.info(f'Model warmed up in {time.monotonic() - started:.2f} s')
+
+    def start(self):
+        """Фазы запуска: загрузка весов, прогрев, после чего сервис сообщает о готовности."""
+        self.load()
+        self.warmup()
+        self.ready = True
+        logging.info('Model is ready')
+
+    @contextmanager
+    def acquire(self):
+        """Выдаёт pipeline на время инференса; после выгрузки модель лениво загружается заново."""
+        with self._lock:
+            self._in_use += 1
+        try:
+            yield self.load()
+        finally:
+            with self._lock:
+                self._in_use -= 1
+                self._last_used = time.monotonic()
+
+    def unload_if_idle(self) -> bool:
+        with self._lock:
+            idle = time.monotonic() - self._last_used
+            if self._pipe is None or self._in_use or idle < self.idle_unload_seconds:
+                return False
+            self._pipe = None
+        gc.collect()
+        logging.info(f'Model unloaded after {idle:.0f} s of inactivity')
+        return True
+
+    async def watch_idle(self):
+        """Фоновая задача выгрузки модели при простое."""
+        if self.idle_unload_seconds <= 0:
+            return
+        while True:
+            await asyncio.sleep(min(60.0, self.idle_unload_seconds))
+            self.unload_if_idle()
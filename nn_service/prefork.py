@@ -0,0 +1,71 @@
+import gc
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List
+
+import torch
+
+# Количество процессов инференса (0 или 1 - инференс в потоках основного процесса)
+PREFORK_WORKERS = int(os.getenv('PREFORK_WORKERS', '0'))
+# Потоков torch на процесс (0 - по числу ядер, закреплённых за процессом)
+THREADS_PER_WORKER = int(os.getenv('THREADS_PER_WORKER', '0'))
+# Сколько ждать прогрева всех процессов при старте
+PREFORK_STARTUP_TIMEOUT = float(os.getenv('PREFORK_STARTUP_TIMEOUT', '600'))
+
+
+def core_slices(workers: int, cores: List[int] | None = None) -> List[List[int]]:
+    """Делит доступные процессу ядра на непересекающиеся группы, по одной на процесс."""
+    cores = sorted(os.sched_getaffinity(0)) if cores is None else sorted(cores)
+    per_worker = max(1, len(cores) // workers)
+    slices = []
+    for i in range(workers):
+        # Если процессов больше, чем ядер, группы начинают повторяться
+        start = (i * per_worker) % len(cores)
+        slices.append(cores[start:start + per_worker])
+    return slices
+
+
+def _init_worker(counter, barrier, slices: List[List[int]], warmup: Callable[[], None]):
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+
+    cores = slices[index % len(slices)]
+    os.sched_setaffinity(0, cores)
+    threads = THREADS_PER_WORKER or len(cores)
+    torch.set_num_threads(threads)
+    logging.info(f'Inference worker {index} (pid {os.getpid()}): cores={cores}, threads={threads}')
+
+    warmup()
+    # Сервис готов, только когда прогреты все процессы
+    barrier.wait(timeout=PREFORK_STARTUP_TIMEOUT)
+
+
+def _worker_pid() -> int:
+    return os.getpid()
+
+
+def start_prefork_pool(workers: int, warmup: Callable[[], None]) -> ProcessPoolExecutor:
+    """Форкает процессы инференса от процесса, в котором уже загружена модель.
+
+    Страницы весов остаются общими (copy-on-write), поэтому N процессов не держат N копий модели.
+    Свободный процесс сам забирает следующую задачу из общей очереди пула.
+    Модель в родительском процессе до форка не должна запускаться: прогрев делает каждый процесс.
+    """
+    # Убираем объекты из-под сборщика мусора, чтобы он не трогал (и не копировал) общие страницы
+    gc.collect()
+    gc.freeze()
+
+    context = multiprocessing.get_context('fork')
+    counter = context.Value('i', 0)
+    barrier = context.Barrier(workers)
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                               initargs=(counter, barrier, core_slices(workers), warmup))
+
+    # С fork пул запускает все процессы при первой задаче; ждём, пока все прогреются
+    for future in [pool.submit(_worker_pid) for _ in range(workers)]:
+        future.result(timeout=PREFORK_STARTUP_TIMEOUT)
+    logging.info(f'Started {workers} inference workers')
+    return pool
@@ -0,0 +1,51 @@
+import os
+from typing import Iterator, List
+
+import numpy as np
+
+from audio_decoding import SAMPLING_RATE
+
+# Длина окна и перекрытие соседних окон при потоковой транскрипции
+STREAM_WINDOW_SECONDS = float(os.getenv('STREAM_WINDOW_SECONDS', '30'))
+STREAM_OVERLAP_SECONDS = float(os.getenv('STREAM_OVERLAP_SECONDS', '5'))
+# Сколько окон может одновременно находиться в очереди инференса
+STREAM_LOOKAHEAD = int(os.getenv('STREAM_LOOKAHEAD', '2'))
+
+
+def iter_windows(audio: np.ndarray, window_seconds: float = STREAM_WINDOW_SECONDS,
+                 overlap_seconds: float = STREAM_OVERLAP_SECONDS) -> Iterator[tuple[float, np.ndarray]]:
+    """Нарезает аудио на окна фиксированной длины с перекрытием, возвращает (смещение в секундах, окно)."""
+    window = int(window_seconds * SAMPLING_RATE)
+    step = max(1, window - int(overlap_seconds * SAMPLING_RATE))
+    start = 0
+    while True:
+        yield start / SAMPLING_RATE, audio[start:start + window]
+        if start + window >= len(audio):
+            break
+        start += step
+
+
+def window_bounds(index: int, windows_count: int, offset: float,
+                  window_seconds: float = STREAM_WINDOW_SECONDS,
+                  overlap_seconds: float = STREAM_OVERLAP_SECONDS) -> tuple[float, float]:
+    """Участок времени, за который "отвечает" окно: граница проходит по середине перекрытия."""
+    half_overlap = overlap_seconds / 2
+    own_start = offset + half_overlap if index > 0 else 0.0
+    own_end = offset + window_seconds - half_overlap if index < windows_count - 1 else float('inf')
+    return own_start, own_end
+
+
+def select_segments(chunks: List[dict], offset: float, window_duration: float,
+                    own_start: float, own_end: float) -> List[dict]:
+    """Переводит сегменты окна в абсолютное время и оставляет те, чья середина попадает в участок окна."""
+    segments = []
+    for chunk in chunks:
+        start, end = chunk["timestamp"]
+        start = 0.0 if start is None else start
+        # У последнего сегмента окна whisper может не поставить конечную метку
+        end = window_duration if end is None else end
+        start, end = offset + start, offset + end
+
+        if own_start <= (start + end) / 2 < own_end and chunk["text"].strip():
+            segments.append({"text": chunk["text"].strip(), "start": round(start, 2), "end": round(end, 2)})
+    return segments
@@ -0,0 +1,44 @@
+import io
+import sys
+import wave
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from audio_decoding import AudioDecodingError, SAMPLING_RATE, decode_audio  # noqa: E402
+
+
+def wav_bytes(samples: np.ndarray, rate: int) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(rate)
+        file.writeframes(samples.astype('<i2').tobytes())
+    return buffer.getvalue()
+
+
+def test_wav_is_resampled_to_model_rate():
+    audio = decode_audio(wav_bytes(np.zeros(8000, dtype=np.int16), 8000), 'audio/wav')
+    assert audio.dtype == np.float32
+    assert len(audio) == SAMPLING_RATE
+
+
+def test_pcm_uses_rate_from_content_type():
+    audio = decode_audio(np.full(4000, 16384, dtype='<i2').tobytes(), 'audio/L16; rate=8000')
+    assert len(audio) == 8000
+    assert audio[4000] == pytest.approx(0.5, abs=0.01)
+
+
+@pytest.mark.parametrize('content_type', ['audio/L16;rate=0', 'audio/L16;rate=-8000', 'audio/L16;rate=fast'])
+def test_invalid_pcm_rate_is_rejected(content_type):
+    with pytest.raises(AudioDecodingError):
+        decode_audio(b'\x00\x00' * 100, content_type)
+
+
+@pytest.mark.parametrize('data', [b'', b'not audio at all'])
+def test_empty_or_corrupted_audio_is_rejected(data):
+    with pytest.raises(AudioDecodingError):
+        decode_audio(data, 'audio/ogg')
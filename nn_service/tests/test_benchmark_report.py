@@ -0,0 +1,22 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from benchmark.drivers import Sample  # noqa: E402
+from benchmark.report import compare, summarize  # noqa: E402
+
+
+def test_report_without_server_rss_is_not_compared_on_memory():
+    samples = [Sample(clip='c', latency=0.1, duration=5.0, error=None)]
+    base = summarize(samples, 1.0, 'http', 1, 512.0)
+    new = summarize(samples, 1.0, 'http', 1, None)
+    assert new['peak_rss_mb'] is None
+    assert 'peak_rss_mb' not in {change['metric'] for change in compare(base, new, 10)}
+
+
+def test_latency_regression_is_reported():
+    base = summarize([Sample(clip='c', latency=0.1, duration=5.0, error=None)], 1.0, 'inprocess', 1, 100.0)
+    new = summarize([Sample(clip='c', latency=0.2, duration=5.0, error=None)], 1.0, 'inprocess', 1, 100.0)
+    changes = {change['metric']: change for change in compare(base, new, 10)}
+    assert changes['latency_p50_ms']['regression']
+    assert not changes['peak_rss_mb']['regression']
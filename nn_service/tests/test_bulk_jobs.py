@@ -0,0 +1,89 @@
+import asyncio
+import io
+import json
+import sys
+import wave
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import bulk_jobs  # noqa: E402
+from bulk_jobs import BulkJobManager, BULK_PRIORITY  # noqa: E402
+from inference_scheduler import InferenceScheduler  # noqa: E402
+
+
+def wav_bytes(seconds: float = 0.5) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(16000)
+        file.writeframes(b'\x00\x10' * int(16000 * seconds))
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def dataset(tmp_path, monkeypatch):
+    root = tmp_path / 'datasets'
+    (root / 'calls').mkdir(parents=True)
+    for index in range(6):
+        (root / 'calls' / f'{index}.wav').write_bytes(wav_bytes())
+    (tmp_path / 'secret.wav').write_bytes(wav_bytes())
+    monkeypatch.setattr(bulk_jobs, 'BULK_ROOT', str(root))
+    monkeypatch.setattr(bulk_jobs, 'BULK_JOBS_DIR', str(tmp_path / 'jobs'))
+    return root
+
+
+@pytest.mark.parametrize('directory', ['/', '..', 'calls/../..', '/etc'])
+def test_directory_outside_root_is_rejected(dataset, directory):
+    manager = BulkJobManager(scheduler=None)
+    with pytest.raises(ValueError):
+        manager.create(directory=directory)
+    assert manager.jobs == {}
+
+
+def test_symlink_out_of_root_is_not_read(dataset):
+    (dataset / 'calls' / 'link.wav').symlink_to(dataset.parent / 'secret.wav')
+    job = bulk_jobs.BulkJob(job_id='x', directory=str(dataset / 'calls'))
+    items = asyncio.run(BulkJobManager(scheduler=None)._list_items(job))
+    assert sorted(Path(item).name for item in items) == [f'{index}.wav' for index in range(6)]
+
+
+def test_job_does_not_throttle_itself_without_live_traffic(dataset, monkeypatch):
+    monkeypatch.setattr(bulk_jobs, 'BULK_YIELD_QUEUE_SIZE', 2)
+
+    def infer_batch(payloads, group):
+        return [{'text': 'x'} for _ in payloads]
+
+    async def scenario():
+        scheduler = InferenceScheduler(infer_batch, max_wait_ms=50, workers=1)
+        await scheduler.start()
+        manager = BulkJobManager(scheduler)
+        started = asyncio.get_running_loop().time()
+        # Файлов в работе больше порога уступки: свои задачи в очереди не должны её останавливать
+        job = manager.create(directory='calls', max_in_flight=6)
+        await asyncio.wait_for(manager._tasks[job.job_id], 3)
+        elapsed = asyncio.get_running_loop().time() - started
+        await scheduler.stop()
+        return job, elapsed
+
+    job, elapsed = asyncio.run(scenario())
+    # Уступка очереди ждёт по 0.5 с - без живого трафика её быть не должно
+    assert elapsed < 0.5
+    assert job.status == 'finished'
+    assert job.done == 6 and job.failed == 0
+    results = [json.loads(line) for line in job.results_path.read_text().splitlines()]
+    assert {result['prediction'] for result in results} == {'x'}
+
+
+def test_queued_above_counts_only_higher_priority():
+    async def scenario():
+        scheduler = InferenceScheduler(lambda payloads, group: payloads)
+        for priority in (BULK_PRIORITY, BULK_PRIORITY, 0, 3):
+            scheduler.enqueue(priority, priority=priority)
+        cancelled = scheduler.enqueue('gone', priority=1)
+        cancelled.cancel()
+        return scheduler.queued_above(BULK_PRIORITY), scheduler.queue_size
+
+    assert asyncio.run(scenario()) == (2, 5)
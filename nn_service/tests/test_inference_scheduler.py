@@ -0,0 +1,74 @@
+import asyncio
+import sys
+from concurrent.futures import Executor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from inference_scheduler import InferenceScheduler  # noqa: E402
+
+
+class BrokenPool(Executor):
+    """Пул, в котором умер процесс: любая задача сразу завершается BrokenProcessPool."""
+
+    def __init__(self):
+        self.shut_down = False
+
+    def submit(self, fn, *args, **kwargs):
+        raise BrokenProcessPool('A process in the process pool was terminated abruptly')
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self.shut_down = True
+
+
+def infer_batch(payloads, group):
+    return [payload * 2 for payload in payloads]
+
+
+def test_broken_executor_is_replaced():
+    async def scenario():
+        broken = BrokenPool()
+        restarts = []
+
+        async def restart_executor():
+            restarts.append(1)
+            return ThreadPoolExecutor(max_workers=1)
+
+        scheduler = InferenceScheduler(infer_batch, max_wait_ms=0, workers=2)
+        await scheduler.start(executor=broken, restart_executor=restart_executor)
+        with pytest.raises(BrokenProcessPool):
+            await scheduler.submit(1)
+        results = await asyncio.gather(scheduler.submit(2), scheduler.submit(3))
+        await scheduler.stop()
+        return broken, restarts, results
+
+    broken, restarts, results = asyncio.run(scenario())
+    assert broken.shut_down
+    assert restarts == [1]
+    assert results == [4, 6]
+
+
+def test_failed_restart_keeps_scheduler_running():
+    async def scenario():
+        attempts = []
+
+        async def restart_executor():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise RuntimeError('fork failed')
+            return ThreadPoolExecutor(max_workers=1)
+
+        scheduler = InferenceScheduler(infer_batch, max_wait_ms=0, workers=1)
+        await scheduler.start(executor=BrokenPool(), restart_executor=restart_executor)
+        for payload in (1, 2):
+            with pytest.raises(BrokenProcessPool):
+                await scheduler.submit(payload)
+        result = await scheduler.submit(5)
+        await scheduler.stop()
+        return attempts, result
+
+    attempts, result = asyncio.run(scenario())
+    assert len(attempts) == 2
+    assert result == 10
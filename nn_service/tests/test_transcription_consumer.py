@@ -0,0 +1,121 @@
+import asyncio
+import importlib.util
+import json
+import sys
+from pathlib import Path
+
+SERVICE_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(SERVICE_DIR))
+# У бота модуль с тем же именем, поэтому загружаем по пути под своим именем
+_spec = importlib.util.spec_from_file_location('nn_job_queue', SERVICE_DIR / 'job_queue.py')
+job_queue = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(job_queue)
+
+RESULTS = 'test_results'
+
+
+async def publish_job(broker, audio: bytes = b'RIFF', **headers):
+    await broker.publish(job_queue.JOB_QUEUE, audio, {'job_id': 'job-1', 'reply_to': RESULTS, **headers})
+
+
+async def next_result(broker, timeout: float = 1.0):
+    message = await asyncio.wait_for(broker._queue(RESULTS).get(), timeout)
+    result, _, audio = message.body.partition(b'\n')
+    return json.loads(result), audio
+
+
+async def consume(broker, transcribe, prefetch: int = 4):
+    consumer = job_queue.TranscriptionConsumer(broker, transcribe, prefetch=prefetch)
+    await consumer.start()
+    return consumer
+
+
+def test_result_is_published_with_job_headers_and_audio():
+    async def scenario():
+        broker = job_queue.InMemoryBroker()
+
+        async def transcribe(data, headers):
+            assert data == b'RIFF'
+            return {'prediction': 'привет'}
+
+        await consume(broker, transcribe)
+        await publish_job(broker, chat_id='10', message_id='20')
+        result, audio = await next_result(broker)
+        # Подтверждение идёт сразу после публикации ответа
+        await asyncio.sleep(0.01)
+        free_slots = broker._slots[job_queue.JOB_QUEUE]._value
+        await broker.close()
+        return result, audio, free_slots
+
+    result, audio, free_slots = asyncio.run(scenario())
+    assert result['prediction'] == 'привет'
+    assert (result['job_id'], result['chat_id'], result['message_id']) == ('job-1', '10', '20')
+    assert audio == b'RIFF'
+    # Задача подтверждена: занят только слот, с которым доставка ждёт следующее сообщение
+    assert free_slots == 4 - 1
+
+
+def test_rejected_job_gets_error_reply_without_retry():
+    async def scenario():
+        broker = job_queue.InMemoryBroker()
+        calls = []
+
+        async def transcribe(data, headers):
+            calls.append(data)
+            raise job_queue.JobRejected('bad audio')
+
+        await consume(broker, transcribe)
+        await publish_job(broker)
+        result, _ = await next_result(broker)
+        await asyncio.sleep(0.05)
+        await broker.close()
+        return result, calls
+
+    result, calls = asyncio.run(scenario())
+    assert result['error'] == 'bad audio'
+    assert len(calls) == 1
+
+
+def test_failed_job_is_retried_once_then_answered_with_error():
+    async def scenario():
+        broker = job_queue.InMemoryBroker()
+        calls = []
+
+        async def transcribe(data, headers):
+            calls.append(data)
+            raise RuntimeError('GPU error')
+
+        await consume(broker, transcribe)
+        await publish_job(broker)
+        result, _ = await next_result(broker)
+        await broker.close()
+        return result, calls
+
+    result, calls = asyncio.run(scenario())
+    assert result['error'] == 'GPU error'
+    assert len(calls) == 2
+
+
+def test_prefetch_limits_jobs_in_flight():
+    async def scenario():
+        broker = job_queue.InMemoryBroker()
+        in_flight = peak = 0
+
+        async def transcribe(data, headers):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.02)
+            in_flight -= 1
+            return {'prediction': 'x'}
+
+        await consume(broker, transcribe, prefetch=2)
+        for _ in range(6):
+            await publish_job(broker)
+        results = [await next_result(broker) for _ in range(6)]
+        await broker.close()
+        return peak, results
+
+    peak, results = asyncio.run(scenario())
+    assert peak == 2
+    assert len(results) == 6
@@ -0,0 +1,115 @@
+import bisect
+import os
+from typing import List
+
+import numpy as np
+
+from audio_decoding import SAMPLING_RATE
+
+# Энергетический VAD перед моделью: вырезает тишину в начале, в конце и длинные паузы
+VAD_ENABLED = os.getenv('VAD_ENABLED', '0') == '1'
+VAD_FRAME_MS = int(os.getenv('VAD_FRAME_MS', '30'))
+# Порог речи: на VAD_MARGIN_DB выше уровня шума, но не ниже VAD_MIN_ENERGY_DB (dBFS)
+VAD_MARGIN_DB = float(os.getenv('VAD_MARGIN_DB', '10'))
+VAD_MIN_ENERGY_DB = float(os.getenv('VAD_MIN_ENERGY_DB', '-50'))
+# Паузы короче этого остаются как есть, длиннее - сжимаются до VAD_GAP_MS
+VAD_MIN_SILENCE_MS = int(os.getenv('VAD_MIN_SILENCE_MS', '700'))
+VAD_GAP_MS = int(os.getenv('VAD_GAP_MS', '150'))
+# Запас вокруг каждого участка речи, чтобы не обрезать начала и концы слов
+VAD_PADDING_MS = int(os.getenv('VAD_PADDING_MS', '200'))
+
+
+class SpeechMap:
+    """Соответствие времени в сжатом аудио времени в исходном."""
+
+    def __init__(self, regions: List[tuple[int, int]], gap: int, total: int):
+        # regions - участки речи исходного аудио в отсчётах, в порядке следования
+        self.original_duration = total / SAMPLING_RATE
+        self._original = []
+        self._compressed = []
+        position = 0
+        for start, end in regions:
+            self._original.append((start / SAMPLING_RATE, end / SAMPLING_RATE))
+            self._compressed.append((position / SAMPLING_RATE, (position + end - start) / SAMPLING_RATE))
+            position += end - start + gap
+        self.compressed_duration = max(0, position - gap) / SAMPLING_RATE if regions else 0.0
+
+    @property
+    def trimmed_seconds(self) -> float:
+        return self.original_duration - self.compressed_duration
+
+    def to_original(self, t: float) -> float:
+        if not self._compressed:
+            return t
+        index = max(0, bisect.bisect_right([start for start, _ in self._compressed], t) - 1)
+        compressed_start, compressed_end = self._compressed[index]
+        original_start, original_end = self._original[index]
+        if t <= compressed_end:
+            return original_start + max(0.0, t - compressed_start)
+        # Время внутри вставленной паузы относим к концу предыдущего участка речи
+        return original_end
+
+
+def frame_energies(audio: np.ndarray, frame: int) -> np.ndarray:
+    frames = len(audio) // frame
+    power = np.square(audio[:frames * frame].reshape(frames, frame), dtype=np.float64).mean(axis=1)
+    return 10 * np.log10(power + 1e-10)
+
+
+def detect_speech(audio: np.ndarray) -> List[tuple[int, int]]:
+    """Возвращает участки речи [start, end) в отсчётах."""
+    frame = SAMPLING_RATE * VAD_FRAME_MS // 1000
+    energies = frame_energies(audio, frame)
+    if not len(energies):
+        return [(0, len(audio))] if len(audio) else []
+
+    noise_floor, peak = np.percentile(energies, [10, 95])
+    # Для сплошной речи уровень "шума" близок к пику, поэтому порог не поднимаем выше пик - запас
+    threshold = max(VAD_MIN_ENERGY_DB, min(noise_floor + VAD_MARGIN_DB, peak - VAD_MARGIN_DB))
+    is_speech = energies > threshold
+
+    regions = []
+    min_silence = VAD_MIN_SILENCE_MS // VAD_FRAME_MS
+    for index in np.flatnonzero(is_speech):
+        if regions and index - regions[-1][1] <= min_silence:
+            regions[-1][1] = index + 1
+        else:
+            regions.append([index, index + 1])
+
+    padding = SAMPLING_RATE * VAD_PADDING_MS // 1000
+    return [(max(0, start * frame - padding), min(len(audio), end * frame + padding)) for start, end in regions]
+
+
+def apply_vad(audio: np.ndarray) -> tuple[np.ndarray, SpeechMap]:
+    """Склеивает участки речи через короткие паузы; возвращает сжатое аудио и карту времени."""
+    regions = detect_speech(audio)
+    # После расширения на padding соседние участки могут пересечься
+    merged = []
+    for start, end in regions:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    gap = SAMPLING_RATE * VAD_GAP_MS // 1000
+    speech_map = SpeechMap(merged, gap, len(audio))
+    if not merged:
+        return audio[:0], speech_map
+
+    silence = np.zeros(gap, dtype=audio.dtype)
+    parts = []
+    for start, end in merged:
+        if parts:
+            parts.append(silence)
+        parts.append(audio[start:end])
+    return np.concatenate(parts), speech_map
+
+
+def map_segments(segments: List[dict], speech_map: SpeechMap | None) -> List[dict]:
+    """Переводит метки времени сегментов из сжатого аудио в исходное."""
+    if speech_map is None:
+        return segments
+    return [{**segment,
+             "start": round(speech_map.to_original(segment["start"]), 2),
+             "end": round(speech_map.to_original(segment["end"]), 2)}
+            for segment in segments]
@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, List
+
+
+def _per_role(name: str, default: str) -> List[float]:
+    return [float(value) for value in os.getenv(name, default).split(',')]
+
+
+# Всего голосовых в обработке одновременно (скачивание, ffmpeg и распознавание)
+ADMISSION_SLOTS = int(os.getenv('ADMISSION_SLOTS', '8'))
+# Лимиты по ролям user, beta-tester, unlimited, admin; 0 - без ограничения
+# Одновременно обрабатываемых голосовых одного пользователя
+ROLE_CONCURRENCY = _per_role('ROLE_CONCURRENCY', '1,2,4,0')
+# Секунд аудио в минуту; запас бакета - столько же, то есть минута аудио сразу
+ROLE_AUDIO_SECONDS_PER_MINUTE = _per_role('ROLE_AUDIO_SECONDS_PER_MINUTE', '300,600,1800,0')
+# Бакеты неактивных пользователей удаляются, когда их становится больше
+MAX_IDLE_BUCKETS = 10000
+
+
+def role_limit(limits: List[float], role: int) -> float:
+    return limits[min(max(role, 0), len(limits) - 1)]
+
+
+class TokenBucket:
+    """Бакет в секундах аудио: пополняется со скоростью rate в секунду до capacity."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost: float, now: float) -> float:
+        """Через сколько секунд можно будет списать cost; сообщение длиннее запаса ждёт полного бакета."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        needed = min(cost, self.capacity)
+        return max(0.0, (needed - self.tokens) / self.rate)
+
+    def take(self, cost: float, now: float):
+        # Баланс может уйти в минус: длинное сообщение оплачивается последующим ожиданием
+        if self.rate > 0:
+            self._refill(now)
+            self.tokens -= cost
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+@dataclass
+class Ticket:
+    user_id: int
+    role: int
+    seconds: float
+    future: asyncio.Future = field(repr=False)
+    # Слот передан задаче очереди и освобождается по release_job, а не при выходе из admit
+    held: bool = False
+
+
+class AdmissionController:
+    """Допуск голосовых к обработке: лимиты на пользователя по роли и круговая очередь между пользователями.
+
+    Свободный слот получает следующий по кругу пользователь, у которого не превышен лимит одновременных
+    задач и хватает секунд в бакете, поэтому один пользователь с десятками сообщений не задерживает остальных.
+    """
+
+    def __init__(self, slots: int = ADMISSION_SLOTS):
+        self.slots = max(1, slots)
+        self.active = 0
+        self._active_by_user: Dict[int, int] = {}
+        # Порядок ключей - очередь обхода по кругу
+        self._waiting: 'OrderedDict[int, Deque[Ticket]]' = OrderedDict()
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._timer: asyncio.TimerHandle | None = None
+        # job_id -> (пользователь, таймер освобождения) для слотов, удерживаемых до ответа очереди
+        self._held: Dict[str, tuple[int, asyncio.TimerHandle]] = {}
+
+    @asynccontextmanager
+    async def admit(self, user_id: int, role: int, seconds: float,
+                    on_queued: Callable[[int], Awaitable[None]] | None = None):
+        """Ждёт допуска к обработке; если сразу допустить нельзя, вызывает on_queued(позиция в очереди).
+        Отдаёт билет, по которому слот можно удержать до ответа очереди (hold)."""
+        ticket = Ticket(user_id, role, seconds, asyncio.get_running_loop().create_future())
+        self._waiting.setdefault(user_id, deque()).append(ticket)
+        self._dispatch()
+
+        try:
+            if not ticket.future.done():
+                position = self.position(ticket)
+                logging.info(f'User {user_id} is queued at position {position}')
+                if on_queued is not None:
+                    try:
+                        await on_queued(position)
+                    except Exception as e:
+                        # Сообщение о позиции необязательно (например, сработал flood control Telegram),
+                        # место в очереди из-за него не теряем
+                        logging.error(f'Queue position of user {user_id} is not shown: {e}')
+            await ticket.future
+        except BaseException:
+            if ticket.future.done() and not ticket.future.cancelled():
+                # Слот уже выдан, но обработчик отменён
+                self._release(user_id)
+            else:
+                ticket.future.cancel()
+                self._remove(ticket)
+            raise
+
+        try:
+            yield ticket
+        finally:
+            if not ticket.held:
+                self._release(user_id)
+
+    def hold(self, ticket: Ticket, job_id: str, timeout: float):
+        """Оставляет слот билета занятым после выхода из admit - до release_job(job_id) или истечения timeout,
+        если ответ так и не придёт."""
+        ticket.held = True
+        handle = asyncio.get_running_loop().call_later(timeout, self._expire_job, job_id)
+        self._held[job_id] = (ticket.user_id, handle)
+
+    def release_job(self, job_id: str) -> bool:
+        """Освобождает слот задачи; повторный вызов (повторная доставка ответа) ничего не делает."""
+        held = self._held.pop(job_id, None)
+        if held is None:
+            return False
+        user_id, handle = held
+        handle.cancel()
+        self._release(user_id)
+        return True
+
+    def _expire_job(self, job_id: str):
+        logging.warning(f'No result of job {job_id} in time, its admission slot is released')
+        self.release_job(job_id)
+
+    def position(self, ticket: Ticket) -> int:
+        """Номер в очереди (с 1) в порядке, в котором слоты будут выдаваться по кругу."""
+        queues = [list(queue) for queue in self._waiting.values()]
+        order = []
+        for depth in range(max(map(len, queues), default=0)):
+            order.extend(queue[depth] for queue in queues if depth < len(queue))
+        return order.index(ticket) + 1 if ticket in order else 0
+
+    def _limits(self, role: int) -> tuple[float, float]:
+        return role_limit(ROLE_CONCURRENCY, role), role_limit(ROLE_AUDIO_SECONDS_PER_MINUTE, role) / 60
+
+    def _bucket(self, ticket: Ticket) -> TokenBucket:
+        _, rate = self._limits(ticket.role)
+        bucket = self._buckets.get(ticket.user_id)
+        if bucket is None:
+            bucket = self._buckets[ticket.user_id] = TokenBucket(rate, rate * 60)
+        # Роль могла измениться с прошлого сообщения
+        bucket.rate, bucket.capacity = rate, rate * 60
+        return bucket
+
+    def _dispatch(self):
+        now = time.monotonic()
+        next_check = None
+        granted = True
+        while granted and self.active < self.slots:
+            granted = False
+            for user_id in list(self._waiting):
+                if self.active >= self.slots:
+                    break
+                ticket = self._waiting[user_id][0]
+                max_active, _ = self._limits(ticket.role)
+                if max_active and self._active_by_user.get(user_id, 0) >= max_active:
+                    continue
+                bucket = self._bucket(ticket)
+                wait = bucket.wait_time(ticket.seconds, now)
+                if wait > 0:
+                    next_check = wait if next_check is None else min(next_check, wait)
+                    continue
+
+                bucket.take(ticket.seconds, now)
+                self._waiting[user_id].popleft()
+                if self._waiting[user_id]:
+                    # Пользователь уходит в конец круга
+                    self._waiting.move_to_end(user_id)
+                else:
+                    del self._waiting[user_id]
+                self.active += 1
+                self._active_by_user[user_id] = self._active_by_user.get(user_id, 0) + 1
+                ticket.future.set_result(None)
+                granted = True
+
+        # Пользователь ждёт только пополнения бакета - проверим снова, когда оно наступит
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if next_check is not None and self.active < self.slots:
+            self._timer = asyncio.get_running_loop().call_later(next_check + 0.01, self._dispatch)
+
+    def _remove(self, ticket: Ticket):
+        queue = self._waiting.get(ticket.user_id)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del self._waiting[ticket.user_id]
+
+    def _release(self, user_id: int):
+        self.active -= 1
+        self._active_by_user[user_id] -= 1
+        if not self._active_by_user[user_id]:
+            del self._active_by_user[user_id]
+        if len(self._buckets) > MAX_IDLE_BUCKETS:
+            self._prune_buckets()
+        self._dispatch()
+
+    def _prune_buckets(self):
+        now = time.monotonic()
+        for user_id in list(self._buckets):
+            if user_id not in self._waiting and user_id not in self._active_by_user \
+                    and self._buckets[user_id].is_full(now):
+                del self._buckets[user_id]
@@ -1,44 +1,100 @@
 import logging
 import os
+import time
+from collections import OrderedDict
 
 import aiohttp
 
+from http_client import UpstreamClient
+
 BD_API_URL = os.getenv('BD_API_URL')
+# Соединений к db_assist одновременно и таймаут ответа
+BD_MAX_CONNECTIONS = int(os.getenv('BD_MAX_CONNECTIONS', '20'))
+BD_READ_TIMEOUT = float(os.getenv('BD_READ_TIMEOUT', '10'))
+
+db_client = UpstreamClient('db_assist', BD_API_URL, limit=BD_MAX_CONNECTIONS, read_timeout=BD_READ_TIMEOUT)
+# Профили пользователей (cash, role) кешируются на USER_CACHE_TTL секунд, не больше USER_CACHE_SIZE записей
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '30'))
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+
+
+class UserCache:
+    """Кеш профилей пользователей с ограниченным сроком жизни и вытеснением давно не использованных.
+    Изменения, сделанные через этот модуль, сразу записываются и в кеш."""
+
+    def __init__(self, ttl: float = USER_CACHE_TTL, max_size: int = USER_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max(1, max_size)
+        self.hits = 0
+        self.misses = 0
+        self._users: 'OrderedDict[int, tuple[float, dict]]' = OrderedDict()
+
+    def get(self, user_id: int) -> dict | None:
+        entry = self._users.get(user_id)
+        if entry is None or entry[0] <= time.monotonic():
+            self._users.pop(user_id, None)
+            self.misses += 1
+            return None
+        self._users.move_to_end(user_id)
+        self.hits += 1
+        return dict(entry[1])
+
+    def put(self, user_id: int, user: dict):
+        self._users[user_id] = (time.monotonic() + self.ttl, dict(user))
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.max_size:
+            self._users.popitem(last=False)
+
+    def update(self, user_id: int, **fields):
+        # Обновляем только закешированный профиль; срок жизни не продлеваем
+        entry = self._users.get(user_id)
+        if entry is not None:
+            entry[1].update(fields)
+
+    def invalidate(self, user_id: int):
+        self._users.pop(user_id, None)
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {'size': len(self._users), 'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': self.hits / requests if requests else 0.0}
+
+
+user_cache = UserCache()
 
 
 async def register_user(user_id):
     try:
-        async with aiohttp.ClientSession() as session:
-            user_data = {
-                "tg_id": user_id,  # ID пользователя Telegram
-                "cash": 0,  # Примерный score
-                "role": 0  # Название файла
-            }
-            logging.info(f'user ID: {user_id}')
-            async with session.post(url=f'{BD_API_URL}/register-user/', json=user_data) as resp:
-                if resp.status == 200:
-                    logging.info(f"User {user_id} registered")
-                else:
-                    logging.error(f'Error while registering user: {resp.status}')
+        user_data = {
+            "tg_id": user_id,  # ID пользователя Telegram
+            "cash": 0,  # Примерный score
+            "role": 0  # Название файла
+        }
+        logging.info(f'user ID: {user_id}')
+        async with db_client.post('/register-user/', json=user_data) as resp:
+            if resp.status == 200:
+                logging.info(f"User {user_id} registered")
+                user_cache.invalidate(user_id)
+            else:
+                logging.error(f'Error while registering user: {resp.status}')
     except aiohttp.ClientError as e:
         logging.error(f"FastAPI connection error: {e}")
 
 
 async def add_transcription(user_id: int, duration_seconds: int):
     try:
-        async with aiohttp.ClientSession() as session:
-            transcription_data = {
-                'user_tg_id': user_id,
-                'score': 0,
-                'duration_seconds': duration_seconds,
-            }
-            async with session.post(url=f'{BD_API_URL}/add-transcription/', json=transcription_data) as resp:
-                if resp.status == 200:
-                    logging.info(f"Transcription from user_id {user_id} added")
-                    return await resp.json()
-                else:
-                    logging.error(f"Error while adding transcription: {resp.status}")
-                    return None
+        transcription_data = {
+            'user_tg_id': user_id,
+            'score': 0,
+            'duration_seconds': duration_seconds,
+        }
+        async with db_client.post('/add-transcription/', json=transcription_data) as resp:
+            if resp.status == 200:
+                logging.info(f"Transcription from user_id {user_id} added")
+                return await resp.json()
+            else:
+                logging.error(f"Error while adding transcription: {resp.status}")
+                return None
 
     except aiohttp.ClientError as e:
         logging.error(f"FastAPI connection error: {e}")
@@ -46,14 +102,18 @@ async def add_transcription(user_id: int, duration_seconds: int):
 
 
 async def get_user_info(user_id):
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url=f'{BD_API_URL}/user/{user_id}') as resp:
-                if resp.status == 200:
-                    return await resp.json()
-                else:
-                    logging.error(f"Error while getting user info: {resp.status}")
-                    return None
+        async with db_client.get(f'/user/{user_id}') as resp:
+            if resp.status == 200:
+                user = await resp.json()
+                user_cache.put(user_id, user)
+                return user
+            else:
+                logging.error(f"Error while getting user info: {resp.status}")
+                return None
     except aiohttp.ClientError as e:
         logging.error(f"FastAPI connection error: {e}")
         return None
@@ -67,40 +127,42 @@ async def get_user_cash(user_id):
         return None
 
 
-async def set_transcription_score(transcription_id: int, score: int):
+async def score_transcription(transcription_id: int, score: int):
+    """Оценка, начисление монет и повышение роли одной транзакцией в db_assist.
+    Возвращает data ответа (reward, cash, role, promoted, scored) или None при ошибке."""
     try:
-        async with aiohttp.ClientSession() as session:
-            transcription_data = {
-                'score': score
-            }
-            async with session.put(url=f'{BD_API_URL}/update-transcription-score/{transcription_id}',
-                                   params=transcription_data) as resp:
-                if resp.status == 200:
-                    logging.info(f"Transcription {transcription_id} updated")
-                    return True
-                else:
-                    logging.error(f"Error while updating transcription score: {resp.status}")
-                    return False
+        # Повтор безопасен: монеты за транскрипцию начисляются только один раз
+        async with db_client.request('POST', f'/score-transcription/{transcription_id}', idempotent=True,
+                                     params={'score': score}) as resp:
+            if resp.status == 200:
+                logging.info(f"Transcription {transcription_id} scored")
+                result = (await resp.json())['data']
+                if result.get('tg_id') is not None:
+                    user_cache.update(result['tg_id'], cash=result['cash'], role=result['role'])
+                return result
+            else:
+                logging.error(f"Error while scoring transcription: {resp.status}")
+                return None
 
     except aiohttp.ClientError as e:
         logging.error(f"FastAPI connection error: {e}")
-        return False
+        return None
 
 
 async def set_user_cash(user_id, cash: float):
     try:
-        async with aiohttp.ClientSession() as session:
-            transcription_data = {
-                'new_cash': cash
-            }
-            async with session.put(url=f'{BD_API_URL}/update-user-cash/{user_id}',
-                                   params=transcription_data) as resp:
-                if resp.status == 200:
-                    logging.info(f"User {user_id} updated cash")
-                    return True
-                else:
-                    logging.error(f"Error while updating user cash: {resp.status}")
-                    return False
+        transcription_data = {
+            'new_cash': cash
+        }
+        async with db_client.put(f'/update-user-cash/{user_id}',
+                                 params=transcription_data) as resp:
+            if resp.status == 200:
+                logging.info(f"User {user_id} updated cash")
+                user_cache.update(user_id, cash=cash)
+                return True
+            else:
+                logging.error(f"Error while updating user cash: {resp.status}")
+                return False
 
     except aiohttp.ClientError as e:
         logging.error(f"FastAPI connection error: {e}")
@@ -109,33 +171,51 @@ async def set_user_cash(user_id, cash: float):
 
 async def set_user_role(user_id, role: int):
     try:
-        async with aiohttp.ClientSession() as session:
-            transcription_data = {
-                'new_role': role
-            }
-            async with session.put(url=f'{BD_API_URL}/update-user-role/{user_id}',
-                                   params=transcription_data) as resp:
-                if resp.status == 200:
-                    logging.info(f"User {user_id} updated role ")
-                    return True
-                else:
-                    logging.error(f"Error while updating user role: {resp.status}")
-                    return False
+        transcription_data = {
+            'new_role': role
+        }
+        async with db_client.put(f'/update-user-role/{user_id}',
+                                 params=transcription_data) as resp:
+            if resp.status == 200:
+                logging.info(f"User {user_id} updated role ")
+                user_cache.update(user_id, role=role)
+                return True
+            else:
+                logging.error(f"Error while updating user role: {resp.status}")
+                return False
 
     except aiohttp.ClientError as e:
         logging.error(f"FastAPI connection error: {e}")
         return False
 
 
-async def get_transcription_info(transcription_id: int):
+async def get_cached_transcript(cache_key: str):
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url=f'{BD_API_URL}/transcription/{transcription_id}') as resp:
-                if resp.status == 200:
-                    return await resp.json()
-                else:
-                    logging.error(f"Error while getting transcription info: {resp.status}")
-                    return None
+        async with db_client.get(f'/transcript-cache/{cache_key}') as resp:
+            if resp.status == 200:
+                return await resp.json()
+            elif resp.status != 404:
+                logging.error(f"Error while getting cached transcript: {resp.status}")
+            return None
     except aiohttp.ClientError as e:
         logging.error(f"FastAPI connection error: {e}")
         return None
+
+
+async def save_cached_transcript(cache_key: str, prediction: str, duration_seconds: float):
+    try:
+        transcript_data = {
+            'prediction': prediction,
+            'duration_seconds': duration_seconds,
+        }
+        async with db_client.put(f'/transcript-cache/{cache_key}', json=transcript_data) as resp:
+            if resp.status == 200:
+                logging.info(f"Transcript {cache_key} cached")
+                return True
+            else:
+                logging.error(f"Error while caching transcript: {resp.status}")
+                return False
+
+    except aiohttp.ClientError as e:
+        logging.error(f"FastAPI connection error: {e}")
+        return False
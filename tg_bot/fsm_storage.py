@@ -0,0 +1,177 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+# Хранилище состояний: memory - в памяти процесса; sqlite - локальный файл, переживает перезапуск;
+# redis - общий сервер (redis или совместимый), для нескольких экземпляров бота
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'memory')
+# Запись удаляется, если её не обновляли столько секунд (например, неподтверждённое голосовое)
+FSM_TTL = int(os.getenv('FSM_TTL', str(24 * 60 * 60)))
+# Больше записей не храним: вытесняются те, что дольше всего не обновлялись
+FSM_MAX_KEYS = int(os.getenv('FSM_MAX_KEYS', '100000'))
+FSM_SQLITE_PATH = os.getenv('FSM_SQLITE_PATH', './fsm.sqlite3')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://redis:6379/0')
+# Как часто sqlite-хранилище удаляет устаревшие записи
+SWEEP_INTERVAL = 60
+
+
+def _state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+@dataclass
+class _Record:
+    state: Optional[str] = None
+    data: Dict[str, Any] = field(default_factory=dict)
+    expires_at: float = 0.0
+
+
+class BoundedMemoryStorage(BaseStorage):
+    """Замена MemoryStorage с ограниченным объёмом: у каждой записи свой срок жизни, общее число записей
+    ограничено. Чтение не создаёт записей, пустая запись удаляется."""
+
+    def __init__(self, ttl: float = FSM_TTL, max_keys: int = FSM_MAX_KEYS):
+        self.ttl = ttl
+        self.max_keys = max(1, max_keys)
+        # Порядок - по времени последней записи, поэтому в начале и устаревшие, и кандидаты на вытеснение
+        self._records: 'OrderedDict[StorageKey, _Record]' = OrderedDict()
+
+    def _get(self, key: StorageKey) -> Optional[_Record]:
+        record = self._records.get(key)
+        if record is not None and record.expires_at <= time.monotonic():
+            del self._records[key]
+            return None
+        return record
+
+    def _put(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]):
+        if state is None and not data:
+            self._records.pop(key, None)
+            return
+        self._records[key] = _Record(state, data, time.monotonic() + self.ttl)
+        self._records.move_to_end(key)
+        self._sweep()
+
+    def _sweep(self):
+        now = time.monotonic()
+        while self._records:
+            key, record = next(iter(self._records.items()))
+            if record.expires_at > now and len(self._records) <= self.max_keys:
+                break
+            del self._records[key]
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._get(key)
+        self._put(key, _state_name(state), record.data if record else {})
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self._get(key)
+        return record.state if record else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = self._get(key)
+        self._put(key, record.state if record else None, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self._get(key)
+        return record.data.copy() if record else {}
+
+    async def close(self) -> None:
+        self._records.clear()
+
+
+class SqliteStorage(BaseStorage):
+    """Хранилище в локальном файле SQLite с теми же сроком жизни и ограничением числа записей.
+    Запросы выполняются в отдельном потоке, чтобы запись на диск не блокировала event loop."""
+
+    def __init__(self, path: str = FSM_SQLITE_PATH, ttl: float = FSM_TTL, max_keys: int = FSM_MAX_KEYS):
+        self.ttl = ttl
+        self.max_keys = max(1, max_keys)
+        self._lock = threading.Lock()
+        self._key_builder = DefaultKeyBuilder(with_bot_id=True, with_business_connection_id=True,
+                                              with_destiny=True)
+        self._last_sweep = 0.0
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS fsm ('
+                         'key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL, expires_at REAL NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS fsm_expires_at ON fsm (expires_at)')
+
+    async def _call(self, method, *args):
+        return await asyncio.to_thread(self._locked, method, *args)
+
+    def _locked(self, method, *args):
+        with self._lock:
+            return method(*args)
+
+    def _get(self, key: str) -> tuple[Optional[str], Dict[str, Any]]:
+        row = self._db.execute('SELECT state, data FROM fsm WHERE key = ? AND expires_at > ?',
+                               (key, time.time())).fetchone()
+        if row is None:
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    def _put(self, key: str, state: Optional[str] = None, data: Optional[Dict[str, Any]] = None,
+             update_state: bool = False):
+        current_state, current_data = self._get(key)
+        state = state if update_state else current_state
+        data = current_data if data is None else data
+        if state is None and not data:
+            self._db.execute('DELETE FROM fsm WHERE key = ?', (key,))
+            return
+        self._db.execute('INSERT OR REPLACE INTO fsm (key, state, data, expires_at) VALUES (?, ?, ?, ?)',
+                         (key, state, json.dumps(data, ensure_ascii=False), time.time() + self.ttl))
+        if time.monotonic() - self._last_sweep > SWEEP_INTERVAL:
+            self._sweep()
+
+    def _sweep(self):
+        self._last_sweep = time.monotonic()
+        expired = self._db.execute('DELETE FROM fsm WHERE expires_at <= ?', (time.time(),)).rowcount
+        # Сверх лимита удаляются записи, которые истекут раньше всех, то есть дольше всего не обновлялись
+        evicted = self._db.execute(
+            'DELETE FROM fsm WHERE key IN (SELECT key FROM fsm ORDER BY expires_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_keys,)).rowcount
+        if expired or evicted:
+            logging.info(f'FSM storage: {expired} expired and {evicted} evicted records removed')
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._call(self._put, self._key_builder.build(key), _state_name(state), None, True)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._call(self._get, self._key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._call(self._put, self._key_builder.build(key), None, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._call(self._get, self._key_builder.build(key))
+        return data
+
+    async def close(self) -> None:
+        await self._call(self._sweep)
+        await self._call(self._db.close)
+
+
+def create_storage(kind: str = FSM_STORAGE) -> BaseStorage:
+    if kind == 'memory':
+        return BoundedMemoryStorage()
+    if kind == 'sqlite':
+        return SqliteStorage()
+    if kind == 'redis':
+        # Зависимость нужна только для этого варианта; размер ограничивает maxmemory-policy самого redis
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        return RedisStorage.from_url(REDIS_URL, state_ttl=FSM_TTL, data_ttl=FSM_TTL,
+                                     key_builder=DefaultKeyBuilder(with_destiny=True))
+    raise ValueError(f'Unknown FSM storage: {kind}')
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import os
+import random
+from contextlib import asynccontextmanager
+from typing import List
+
+import aiohttp
+
+# Общие настройки HTTP-клиентов к сервисам проекта
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+# Повторы только для идемпотентных запросов (GET и PUT с абсолютным значением)
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', '3'))
+HTTP_RETRY_BACKOFF = float(os.getenv('HTTP_RETRY_BACKOFF', '0.2'))
+# Сколько держать простаивающее соединение открытым
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv('HTTP_KEEPALIVE_TIMEOUT', '30'))
+RETRY_STATUSES = {502, 503, 504}
+
+_clients: List['UpstreamClient'] = []
+
+
+class UpstreamClient:
+    """Долгоживущая сессия aiohttp к одному сервису: пул keep-alive соединений, таймауты и повторы."""
+
+    def __init__(self, name: str, base_url: str | None, limit: int, read_timeout: float | None,
+                 total_timeout: float | None = None):
+        self.name = name
+        self.base_url = (base_url or '').rstrip('/')
+        self.limit = limit
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, sock_connect=HTTP_CONNECT_TIMEOUT,
+                                             sock_read=read_timeout)
+        self._session: aiohttp.ClientSession | None = None
+        _clients.append(self)
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # Обычно сессия создаётся при старте бота; здесь - на случай вызова до старта
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def start(self):
+        _ = self.session
+        logging.info(f'HTTP client for {self.name} started: limit={self.limit}')
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def url(self, path: str) -> str:
+        return f'{self.base_url}{path}' if path.startswith('/') else path
+
+    @asynccontextmanager
+    async def request(self, method: str, path: str, idempotent: bool = False, **kwargs):
+        """Выполняет запрос и отдаёт ответ внутри контекста.
+
+        Идемпотентные запросы повторяются при ошибке соединения, таймауте и 502/503/504
+        с экспоненциальной задержкой и случайным разбросом. Таймаут приводится к aiohttp.ClientError.
+        """
+        attempts = 1 + (HTTP_RETRIES if idempotent else 0)
+        for attempt in range(attempts):
+            last_attempt = attempt + 1 == attempts
+            try:
+                response = await self.session.request(method, self.url(path), **kwargs)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if last_attempt:
+                    if isinstance(e, aiohttp.ClientError):
+                        raise
+                    raise aiohttp.ServerTimeoutError(f'{self.name}: {method} {path} timed out') from e
+                logging.warning(f'{self.name}: {method} {path} failed ({e!r}), retrying')
+            else:
+                if response.status not in RETRY_STATUSES or last_attempt:
+                    try:
+                        yield response
+                    except asyncio.TimeoutError as e:
+                        # Таймаут чтения тела ответа
+                        raise aiohttp.ServerTimeoutError(f'{self.name}: {method} {path} timed out') from e
+                    finally:
+                        response.release()
+                    return
+                logging.warning(f'{self.name}: {method} {path} returned {response.status}, retrying')
+                response.release()
+            # Полный джиттер: одновременные повторы многих обработчиков не бьют в сервис синхронно
+            await asyncio.sleep(random.uniform(0, HTTP_RETRY_BACKOFF * 2 ** attempt))
+
+    def get(self, path: str, **kwargs):
+        return self.request('GET', path, idempotent=True, **kwargs)
+
+    def put(self, path: str, **kwargs):
+        return self.request('PUT', path, idempotent=True, **kwargs)
+
+    def post(self, path: str, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+
+async def start_all():
+    for client in _clients:
+        await client.start()
+
+
+async def close_all():
+    for client in _clients:
+        await client.close()
+    logging.info('HTTP clients closed')
@@ -0,0 +1,265 @@
+import asyncio
+import io
+import json
+import logging
+import os
+import random
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import BinaryIO, Dict, List
+
+import bd_connect_module as main_bd
+import s3_connect_module as s3
+from transcoding import AUDIO_SPILL_BYTES
+
+# Каталог outbox: задачи, которые не успели сохранить, переживают перезапуск бота
+PERSIST_DIR = os.getenv('PERSIST_DIR', './outbox')
+if os.getenv('BOT_MODE') == 'webhook-worker':
+    # У каждого обработчика вебхука свой outbox: ключи оценки разрешаются в процессе, выдавшем клавиатуру
+    PERSIST_DIR = os.path.join(PERSIST_DIR, f'worker-{os.getenv("WORKER_INDEX", "0")}')
+# Сколько задач сохраняется одновременно
+PERSIST_CONCURRENCY = int(os.getenv('PERSIST_CONCURRENCY', '4'))
+# Сколько аудио держать в памяти; аудио остальных задач (и длиннее AUDIO_SPILL_MB) сразу пишется в outbox
+PERSIST_MAX_IN_MEMORY = int(os.getenv('PERSIST_MAX_IN_MEMORY', '32'))
+# Задержка повтора после ошибки: растёт вдвое до максимума
+PERSIST_RETRY_DELAY = float(os.getenv('PERSIST_RETRY_DELAY', '1'))
+PERSIST_RETRY_MAX_DELAY = float(os.getenv('PERSIST_RETRY_MAX_DELAY', '300'))
+# Ключи клавиатуры начинаются с этого префикса и поэтому не путаются с transcription_id в старых сообщениях
+PERSIST_KEY_PREFIX = 'p'
+# Сколько соответствий ключ клавиатуры -> transcription_id помнить
+PERSIST_RESOLVED_MAX = int(os.getenv('PERSIST_RESOLVED_MAX', '100000'))
+
+
+@dataclass
+class PersistJob:
+    key: str
+    user_id: int
+    duration: float
+    prediction: str
+    transcription_id: int | None = None
+    uploaded: bool = False
+    attempts: int = 0
+    # Задача очереди распознавания, из ответа которой получена транскрипция
+    job_id: str | None = None
+    # Аудио в памяти; None - аудио лежит в outbox
+    audio: bytes | None = field(default=None, repr=False)
+
+
+class PersistenceWorker:
+    """Фоновое сохранение транскрипции: запись в БД и загрузка аудио в хранилище после ответа пользователю.
+
+    Клавиатура оценки получает ключ задачи сразу, а transcription_id появляется после записи в БД.
+    """
+
+    def __init__(self, directory: str = PERSIST_DIR, concurrency: int = PERSIST_CONCURRENCY):
+        self.directory = Path(directory)
+        self.concurrency = max(1, concurrency)
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._in_memory = 0
+        self._workers: List[asyncio.Task] = []
+        self._retries: List[asyncio.TimerHandle] = []
+        self._resolved: 'OrderedDict[str, int]' = OrderedDict()
+        self._waiters: Dict[str, asyncio.Event] = {}
+        # Ключи, для которых запись в БД ещё не создана
+        self._pending: set[str] = set()
+        # job_id -> ключ: повторно доставленный ответ очереди не должен создать вторую запись
+        self._by_job_id: 'OrderedDict[str, str]' = OrderedDict()
+
+    @property
+    def _resolved_path(self) -> Path:
+        return self.directory / 'resolved.jsonl'
+
+    async def start(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._load_resolved()
+        pending = 0
+        for path in sorted(self.directory.glob('*.json')):
+            job = PersistJob(**json.loads(path.read_text()))
+            self._remember_job_id(job)
+            if job.transcription_id is None:
+                self._pending.add(job.key)
+            else:
+                self._resolved[job.key] = job.transcription_id
+            self._queue.put_nowait(job)
+            pending += 1
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+        logging.info(f'Persistence worker started, {pending} jobs restored from outbox')
+
+    async def stop(self):
+        """Останавливает обработку и переносит аудио, оставшееся в памяти, в outbox."""
+        for handle in self._retries:
+            handle.cancel()
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        while not self._queue.empty():
+            self._spill(self._queue.get_nowait())
+
+    async def submit(self, user_id: int, duration: float, prediction: str, audio: BinaryIO | None,
+                     job_id: str | None = None) -> str:
+        """Записывает задачу в outbox, ставит на сохранение и возвращает ключ для клавиатуры оценки.
+        Аудио остаётся в памяти, пока там меньше PERSIST_MAX_IN_MEMORY задач и оно не длиннее AUDIO_SPILL_MB.
+        Без аудио (транскрипция из кеша) создаётся только запись в БД. Для уже принятого job_id
+        возвращается ключ существующей задачи."""
+        if job_id is not None and job_id in self._by_job_id:
+            logging.info(f'Transcription of job {job_id} is already being persisted')
+            return self._by_job_id[job_id]
+        key = PERSIST_KEY_PREFIX + uuid.uuid4().hex[:16]
+        job = PersistJob(key=key, user_id=user_id, duration=duration, prediction=prediction,
+                         uploaded=audio is None, job_id=job_id)
+        self._remember_job_id(job)
+        self._pending.add(key)
+        spill = None
+        if audio is not None:
+            audio.seek(0, io.SEEK_END)
+            size = audio.tell()
+            audio.seek(0)
+            if self._in_memory < PERSIST_MAX_IN_MEMORY and size <= AUDIO_SPILL_BYTES:
+                job.audio = audio.read()
+                self._in_memory += 1
+            else:
+                spill = audio
+        # Описание задачи на диске до постановки в очередь: при аварийном завершении бота запись в БД не потеряется
+        await asyncio.to_thread(self._write, job, spill)
+        self._queue.put_nowait(job)
+        return key
+
+    def knows(self, key: str) -> bool:
+        """Есть ли по ключу запись в БД или задача, которая её создаст; старые ключи вытесняются."""
+        return key in self._resolved or key in self._pending
+
+    async def transcription_id(self, key: str, timeout: float) -> int | None:
+        """transcription_id по ключу клавиатуры; ждёт до timeout секунд, если запись в БД ещё не сделана."""
+        if key not in self._resolved:
+            event = self._waiters.setdefault(key, asyncio.Event())
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                self._waiters.pop(key, None)
+                return None
+        return self._resolved.get(key)
+
+    def _remember_job_id(self, job: PersistJob):
+        if job.job_id is None:
+            return
+        self._by_job_id[job.job_id] = job.key
+        while len(self._by_job_id) > PERSIST_RESOLVED_MAX:
+            self._by_job_id.popitem(last=False)
+
+    def _job_path(self, key: str, suffix: str) -> Path:
+        return self.directory / f'{key}.{suffix}'
+
+    def _write(self, job: PersistJob, audio: BinaryIO | None):
+        """Записывает задачу в outbox: аудио из буфера - в .wav, затем описание - в .json."""
+        if audio is not None:
+            audio.seek(0)
+            with open(self._job_path(job.key, 'wav'), 'wb') as file:
+                while chunk := audio.read(1024 * 1024):
+                    file.write(chunk)
+        self._save(job)
+
+    def _spill(self, job: PersistJob):
+        """Переносит аудио задачи из памяти в outbox."""
+        if job.audio is not None:
+            self._job_path(job.key, 'wav').write_bytes(job.audio)
+            job.audio = None
+            self._in_memory -= 1
+        self._save(job)
+
+    def _save(self, job: PersistJob):
+        record = {key: value for key, value in asdict(job).items() if key != 'audio'}
+        temp_path = self._job_path(job.key, 'json.tmp')
+        temp_path.write_text(json.dumps(record, ensure_ascii=False))
+        os.replace(temp_path, self._job_path(job.key, 'json'))
+
+    def _open_audio(self, job: PersistJob) -> BinaryIO:
+        if job.audio is not None:
+            return io.BytesIO(job.audio)
+        return open(self._job_path(job.key, 'wav'), 'rb')
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                done = await self._persist(job)
+            except asyncio.CancelledError:
+                self._spill(job)
+                raise
+            except Exception as e:
+                logging.error(f'Persisting transcription {job.key} failed: {e}')
+                done = False
+
+            if done:
+                self._finish(job)
+            else:
+                self._retry(job)
+
+    async def _persist(self, job: PersistJob) -> bool:
+        if job.transcription_id is None:
+            transcription = await main_bd.add_transcription(job.user_id, int(job.duration))
+            if not transcription:
+                return False
+            job.transcription_id = transcription['data']['transcription_id']
+            # Оценку можно ставить, как только есть запись в БД
+            self._resolve(job.key, job.transcription_id)
+            # Повтор после перезапуска не должен создать запись второй раз
+            self._save(job)
+
+        if not job.uploaded and job.audio is None and not self._job_path(job.key, 'wav').exists():
+            logging.error(f'Audio of transcription {job.key} is lost, upload skipped')
+            job.uploaded = True
+        if not job.uploaded:
+            with self._open_audio(job) as audio:
+                job.uploaded = await s3.send_file_to_s3(audio, str(job.transcription_id), job.prediction)
+            if not job.uploaded:
+                return False
+        return True
+
+    def _finish(self, job: PersistJob):
+        if job.audio is not None:
+            job.audio = None
+            self._in_memory -= 1
+        for suffix in ('json', 'wav'):
+            self._job_path(job.key, suffix).unlink(missing_ok=True)
+
+    def _retry(self, job: PersistJob):
+        job.attempts += 1
+        # Ожидающая повтора задача уже не занимает память
+        self._spill(job)
+        delay = min(PERSIST_RETRY_MAX_DELAY, PERSIST_RETRY_DELAY * 2 ** job.attempts)
+        delay *= random.uniform(0.5, 1.0)
+        logging.warning(f'Transcription {job.key} is not persisted yet, retry {job.attempts} in {delay:.0f} s')
+        self._retries = [handle for handle in self._retries if not handle.cancelled()]
+        self._retries.append(asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, job))
+
+    def _resolve(self, key: str, transcription_id: int):
+        self._resolved[key] = transcription_id
+        self._pending.discard(key)
+        while len(self._resolved) > PERSIST_RESOLVED_MAX:
+            self._resolved.popitem(last=False)
+        with open(self._resolved_path, 'a', encoding='utf-8') as file:
+            file.write(json.dumps({'key': key, 'transcription_id': transcription_id}) + '\n')
+        event = self._waiters.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def _load_resolved(self):
+        if not self._resolved_path.exists():
+            return
+        with open(self._resolved_path, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self._resolved[record['key']] = record['transcription_id']
+                while len(self._resolved) > PERSIST_RESOLVED_MAX:
+                    self._resolved.popitem(last=False)
+        # Переписываем файл, оставляя только последние соответствия
+        temp_path = self._resolved_path.with_suffix('.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            for key, transcription_id in self._resolved.items():
+                file.write(json.dumps({'key': key, 'transcription_id': transcription_id}) + '\n')
+        os.replace(temp_path, self._resolved_path)
@@ -1,35 +1,62 @@
 import asyncio
-import json
+import io
 import logging
 import os
 import tempfile
+import time
 
 from aiogram import Bot, Dispatcher
 from aiogram import F, Router
 from aiogram.client.session import aiohttp
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import CommandStart, Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, File, InputFile, \
     FSInputFile, ReplyKeyboardMarkup, KeyboardButton
+from dataclasses import replace
 from datetime import datetime
+from typing import BinaryIO, List
 import aiohttp
 
 import bd_connect_module as main_bd
+from admission import AdmissionController, Ticket
+from fsm_storage import create_storage
+from persistence import PersistenceWorker, PERSIST_KEY_PREFIX
+import http_client
+import job_queue
+import webhook
 import transcription_connection_module as tranc
-import s3_connect_module as s3
+from transcoding import audio_buffer, transcode_to_wav, TranscodingError
+from transcript_cache import TranscriptCache, file_key, content_key
 from messages_text import start_text, help_text, beta_tester_update_text
 
 # from config import API_TOKEN
 
 MAX_MESSAGE_LENGTH = 4000
+# Сообщения длиннее этого порога распознаются потоково, с показом промежуточного текста
+STREAM_MIN_DURATION = float(os.getenv('STREAM_MIN_DURATION', '30'))
+# Минимальный интервал между редактированиями сообщения с промежуточным текстом
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '2'))
+# Сколько ждать фонового сохранения транскрипции, если её оценили раньше, чем она записалась в БД
+SCORE_RESOLVE_TIMEOUT = float(os.getenv('SCORE_RESOLVE_TIMEOUT', '10'))
+# Сколько ждать ответа из очереди распознавания, прежде чем освободить слот допуска (JOB_TRANSPORT=amqp)
+JOB_RESULT_TIMEOUT = float(os.getenv('JOB_RESULT_TIMEOUT', '900'))
+# polling - один процесс опрашивает Telegram; webhook - фронт принимает обновления и раздаёт их процессам-обработчикам
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
 BD_API_URL = os.getenv('BD_API_URL')
 API_TOKEN = os.getenv('TELEGRAM_TOKEN')
 
 
 bot = Bot(token=API_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+# Состояния и неподтверждённые голосовые хранятся ограниченное время и в ограниченном количестве
+dp = Dispatcher(storage=create_storage())
+# Допуск голосовых к обработке: лимиты по ролям и очередь по кругу между пользователями
+admission = AdmissionController()
+# Запись транскрипций в БД и загрузка аудио в хранилище после ответа пользователю
+persistence = PersistenceWorker()
+# Готовые транскрипции пересланных и повторно присланных голосовых
+transcripts = TranscriptCache()
 
 SCORE = {
     'bad': 1,
@@ -52,9 +79,33 @@ def generate_short_id(file_id: str) -> str:
     return hashlib.sha256(file_id.encode()).hexdigest()[:10]  # Берем только первые 10 символов хеша
 
 
+def pending_voice(state: FSMContext, short_id: str) -> FSMContext:
+    # Каждое голосовое, ожидающее подтверждения, - отдельная запись хранилища и истекает независимо
+    return FSMContext(storage=state.storage, key=replace(state.key, destiny=f'voice:{short_id}'))
+
+
 async def main():
     # dp.include_router(router)
-    await dp.start_polling(bot)
+    # Сессии к сервисам живут всё время работы бота и закрываются при остановке
+    dp.startup.register(http_client.start_all)
+    dp.startup.register(persistence.start)
+    # Фоновое сохранение останавливается раньше, чем закрываются HTTP-клиенты
+    dp.shutdown.register(persistence.stop)
+    dp.shutdown.register(http_client.close_all)
+    if job_queue.JOB_TRANSPORT != 'http':
+        dp.startup.register(start_job_results)
+        dp.shutdown.register(job_queue.close)
+
+    if BOT_MODE == 'webhook':
+        await webhook.WebhookFront(os.path.abspath(__file__)).run(dp, bot)
+    elif BOT_MODE == 'webhook-worker':
+        await webhook.run_worker(dp, bot)
+    else:
+        await dp.start_polling(bot)
+
+
+async def start_job_results():
+    await job_queue.start(handle_job_result)
 
 
 class VoiceProcessing(StatesGroup):
@@ -98,6 +149,22 @@ async def get_help(message: Message):
     await message.answer(text=help_text)
 
 
+# Статистика кешей, только для администраторов
+@dp.message(Command(commands=['stats']))
+async def get_stats(message: Message):
+    user = await main_bd.get_user_info(message.from_user.id)
+    if not user or user['role'] < ROLE['admin']:
+        return
+    stats = main_bd.user_cache.stats()
+    await message.answer(text=f"Кеш пользователей:\nЗаписей: {stats['size']}\n"
+                              f"Попаданий: {stats['hits']}\nПромахов: {stats['misses']}\n"
+                              f"Доля попаданий: {stats['hit_ratio']:.1%}")
+    stats = transcripts.stats()
+    await message.answer(text=f"Кеш транскрипций:\nЗаписей в памяти: {stats['size']}\n"
+                              f"Попаданий: {stats['memory_hits']} в памяти, {stats['db_hits']} в БД\n"
+                              f"Промахов: {stats['misses']}\nДоля попаданий: {stats['hit_ratio']:.1%}")
+
+
 @dp.message(Command(commands=['getrolebetatester$']))
 async def set_role_beta_tester(message: Message):
     user_id = message.from_user.id
@@ -111,9 +178,10 @@ async def set_role_beta_tester(message: Message):
 async def handle_voice(message: Message, state: FSMContext):
     voice = message.voice
 
-    # Сохраняем file_id в состоянии пользователя
+    # Сохраняем file_id отдельной записью со своим сроком жизни; длительность нужна для лимита секунд аудио
     short_id = generate_short_id(voice.file_id)
-    await state.update_data({short_id: voice.file_id})
+    await pending_voice(state, short_id).set_data({'file_id': voice.file_id, 'duration': voice.duration,
+                                                   'file_unique_id': voice.file_unique_id})
 
     # Создаем inline-кнопку с коротким идентификатором
     confirm_button = InlineKeyboardButton(
@@ -139,8 +207,9 @@ async def confirm_audio_processing(callback: CallbackQuery, state: FSMContext):
     error = False
 
     # Получаем полный file_id по короткому идентификатору
-    data = await state.get_data()
-    file_id = data.get(short_id)
+    pending = pending_voice(state, short_id)
+    data = await pending.get_data()
+    file_id = data.get('file_id')
 
     if not file_id:
         await callback.message.answer("Ошибка: не удалось найти идентификатор файла.")
@@ -149,6 +218,20 @@ async def confirm_audio_processing(callback: CallbackQuery, state: FSMContext):
     # Не забываем ответить на callback, чтобы убрать значок загрузки
     await callback.answer()
 
+    # Запись удаляем сразу: ожидание в очереди может быть долгим, а повторное нажатие не должно
+    # поставить то же сообщение в очередь второй раз
+    duration_hint = data.get('duration', 0)
+    await pending.clear()
+
+    # Пересланное голосовое уже распознавалось: отвечаем сразу, без скачивания, очереди и распознавания
+    cache_keys = [file_key(data['file_unique_id'])] if data.get('file_unique_id') else []
+    cached = await transcripts.lookup(cache_keys[0]) if cache_keys else None
+    if cached is not None:
+        prediction, duration = cached
+        await finish_transcription(callback.message.chat.id, callback.message.message_id,
+                                   callback.from_user.id, prediction, duration, None)
+        return
+
     # Загружаем файл с помощью file_id
 
     try:
@@ -160,124 +243,180 @@ async def confirm_audio_processing(callback: CallbackQuery, state: FSMContext):
                                          reply_markup=None)
         return
 
-    await callback.message.edit_text(text='Производится обработка, ожидайте...', reply_markup=None)
-
-    # Работа с временными файлами
-    # current_datetime = datetime.now()
-    # new_file_name = current_datetime.strftime('%Y_%m_%d_%H_%M_%S')
-
-    with tempfile.NamedTemporaryFile(suffix=".ogg", delete=False) as temp_ogg_file:
-        await bot.download_file(file_path, temp_ogg_file.name)
-
-        duration = await get_audio_duration(temp_ogg_file.name)
-        logging.info(f'duration: {duration}')
-
-        # Преобразуем аудио в подходящий формат (например, wav)
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_wav_file:
-            os.system(f"ffmpeg -y -i {temp_ogg_file.name} -ar 16000 -ac 1 {temp_wav_file.name}")
-
-    prediction = await tranc.get_prediction(temp_wav_file.name)
-
-    if prediction:
+    # Роль пользователя определяет его лимиты и приоритет в очереди распознавания
+    user = await main_bd.get_user_info(callback.from_user.id)
+    role = user['role'] if user else ROLE['user']
 
-        transcription = await main_bd.add_transcription(callback.from_user.id, int(duration))
-        if not transcription:
-            logging.error("Transcription is not added to database")
+    async def on_queued(position: int):
+        await callback.message.edit_text(text=f'Сообщение в очереди на обработку, позиция: {position}.\n'
+                                              f'Обработка начнётся автоматически.', reply_markup=None)
 
-        transcription_id = transcription['data']['transcription_id']
+    async with admission.admit(callback.from_user.id, role, duration_hint, on_queued) as ticket:
+        await process_voice(callback, file_path, role, cache_keys, ticket)
 
-        is_file_download = await s3.send_file_to_s3(temp_wav_file.name, str(transcription_id), prediction)
 
-        get_score_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text='❌', callback_data=f'score:bad:{transcription_id}'),
-             InlineKeyboardButton(text='👌', callback_data=f'score:normal:{transcription_id}'),
-             InlineKeyboardButton(text='✅', callback_data=f'score:best:{transcription_id}'),
-             ]])
-
-        await callback.message.edit_text("Аудио успешно распознано")
+async def process_voice(callback: CallbackQuery, file_path: str, role: int, cache_keys: List[str], ticket: Ticket):
+    """Скачивание, конвертация и распознавание одного голосового после допуска к обработке.
+    В режиме очереди слот допуска удерживается до ответа распознавания (handle_job_result)."""
+    await callback.message.edit_text(text='Производится обработка, ожидайте...', reply_markup=None)
 
-        await return_prediction(prediction, callback.message, get_score_keyboard)
+    # Голосовое скачивается и конвертируется в памяти, на диск буферы сбрасываются только сверх AUDIO_SPILL_MB
+    with audio_buffer() as voice_audio:
+        await bot.download_file(file_path, destination=voice_audio)
+
+        # Тот же файл мог прийти заново под другим file_unique_id - проверяем по содержимому
+        hash_key = await content_key(voice_audio)
+        cached = await transcripts.lookup(hash_key)
+        if cached is not None:
+            prediction, duration = cached
+            await finish_transcription(callback.message.chat.id, callback.message.message_id,
+                                       callback.from_user.id, prediction, duration, None, cache_keys)
+            return
+        cache_keys = cache_keys + [hash_key]
+
+        # Преобразуем аудио в WAV 16 кГц в отдельном процессе, не блокируя бота;
+        # длительность берём из результата конвертации
+        try:
+            wav_audio, duration = await transcode_to_wav(voice_audio)
+        except TranscodingError as e:
+            logging.error(f'Audio transcoding error: {e}')
+            await callback.message.edit_text("К сожалению произошла ошибка.")
+            return
+    logging.info(f'duration: {duration}')
+
+    # Один и тот же буфер отправляется и в nn_service, и в хранилище
+    with wav_audio:
+        if job_queue.JOB_TRANSPORT != 'http':
+            # Ответ придёт из очереди результатов, его обработает handle_job_result и освободит слот
+            job_id = job_queue.new_job_id()
+            admission.hold(ticket, job_id, JOB_RESULT_TIMEOUT)
+            try:
+                await job_queue.publish_job(wav_audio, job_id, chat_id=callback.message.chat.id,
+                                            message_id=callback.message.message_id,
+                                            user_id=callback.from_user.id, priority=role, duration=duration,
+                                            cache_keys=','.join(cache_keys))
+            except asyncio.CancelledError:
+                admission.release_job(job_id)
+                raise
+            except Exception as e:
+                logging.error(f'Transcription job is not published: {e}')
+                admission.release_job(job_id)
+                await callback.message.edit_text("К сожалению произошла ошибка.")
+                return
+            await callback.message.edit_text("Аудио в очереди на распознавание, ожидайте...")
+        else:
+            if duration > STREAM_MIN_DURATION:
+                prediction = await tranc.get_prediction_stream(wav_audio, make_partial_editor(callback.message),
+                                                               priority=role)
+            else:
+                prediction = await tranc.get_prediction(wav_audio, priority=role)
+
+            if prediction:
+                await finish_transcription(callback.message.chat.id, callback.message.message_id,
+                                           callback.from_user.id, prediction, duration, wav_audio, cache_keys)
+            else:
+                await callback.message.edit_text("К сожалению произошла ошибка.")
+
+
+async def finish_transcription(chat_id: int, message_id: int, user_id: int, prediction: str, duration: float,
+                               wav_audio: BinaryIO | None, cache_keys: List[str] = (), job_id: str | None = None):
+    """Сразу отправляет текст пользователю; запись в БД и загрузка аудио в хранилище идут в фоне.
+    wav_audio None - транскрипция из кеша, аудио уже есть в хранилище. По cache_keys транскрипция запоминается.
+    job_id - задача очереди: при повторной доставке ответа сохранение не повторяется, повторяется только ответ."""
+    # Клавиатура ссылается на ключ задачи сохранения, transcription_id находится по нему при оценке
+    persist_key = await persistence.submit(user_id, duration, prediction, wav_audio, job_id=job_id)
+
+    get_score_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text='❌', callback_data=f'score:bad:{persist_key}'),
+         InlineKeyboardButton(text='👌', callback_data=f'score:normal:{persist_key}'),
+         InlineKeyboardButton(text='✅', callback_data=f'score:best:{persist_key}'),
+         ]])
 
-    else:
-        await callback.message.edit_text("К сожалению произошла ошибка.")
+    try:
+        await bot.edit_message_text("Аудио успешно распознано", chat_id=chat_id, message_id=message_id)
+    except TelegramBadRequest as e:
+        # При повторной доставке ответа статус мог быть уже изменён
+        if 'message is not modified' not in str(e):
+            raise
 
-    # Удаление временных файлов
-    os.remove(temp_ogg_file.name)
-    os.remove(temp_wav_file.name)
+    await return_prediction(prediction, chat_id, message_id, get_score_keyboard)
 
-    data.pop(short_id, None)  # Удаляем ключ, если он существует
-    await state.update_data(data)
+    await transcripts.store(cache_keys, prediction, duration)
 
 
-async def get_audio_duration(filename: str) -> float:
-    """Асинхронно получает длительность аудиофайла с помощью ffprobe."""
-    process = await asyncio.create_subprocess_exec(
-        'ffprobe', '-v', 'error', '-show_entries',
-        'format=duration', '-of', 'json', filename,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
-    )
+async def handle_job_result(result: dict, audio: bytes):
+    """Ответ nn_service из очереди результатов (JOB_TRANSPORT=amqp)."""
+    # Распознавание закончено - слот допуска пользователя свободен, даже если ответить не удастся
+    admission.release_job(str(result.get('job_id')))
+    chat_id, message_id = int(result['chat_id']), int(result['message_id'])
+    if 'error' in result or not result.get('prediction'):
+        logging.error(f'Transcription job {result.get("job_id")} failed: {result.get("error")}')
+        await bot.edit_message_text("К сожалению произошла ошибка.", chat_id=chat_id, message_id=message_id)
+        return
+    await finish_transcription(chat_id, message_id, int(result['user_id']), result['prediction'],
+                               float(result['duration']), io.BytesIO(audio),
+                               [key for key in result.get('cache_keys', '').split(',') if key],
+                               job_id=result.get('job_id'))
 
-    stdout, stderr = await process.communicate()
 
-    if process.returncode != 0:
-        print(f"Ошибка ffprobe: {stderr.decode()}")
-        return 0.0
+def make_partial_editor(message: Message):
+    """Возвращает колбэк, который показывает промежуточную транскрипцию, не чаще STREAM_EDIT_INTERVAL."""
+    last_edit = 0.0
 
-    info = json.loads(stdout.decode())
-    return float(info["format"]["duration"])
+    async def on_partial(text: str):
+        nonlocal last_edit
+        now = time.monotonic()
+        if now - last_edit < STREAM_EDIT_INTERVAL:
+            return
+        last_edit = now
 
+        header = 'Производится обработка, ожидайте...\n\n'
+        limit = MAX_MESSAGE_LENGTH - len(header)
+        # Длинный текст показываем с конца, полная транскрипция придёт отдельным сообщением
+        preview = text if len(text) <= limit else '...' + text[-(limit - 3):]
+        try:
+            await message.edit_text(text=header + preview, reply_markup=None)
+        except TelegramBadRequest as e:
+            logging.warning(f'Partial transcription is not shown: {e}')
 
-async def calculate_balance(balance, duration_seconds):
-    k = 0.016 * 5
-    if 20 < duration_seconds < 30:
-        k *= 1.5
-    result = round(k * duration_seconds, 2)
-    return balance + result, result
+    return on_partial
 
 
 @dp.callback_query(F.data.startswith("score:"))
 async def feedback_transcription(callback: CallbackQuery):
     callback_data = callback.data.split(":")
     score = SCORE[callback_data[1]]
-    transcription_id = int(callback_data[2])
+    # В новых сообщениях в кнопках ключ фонового сохранения, в старых - сам transcription_id
+    key = callback_data[2]
+    if key.startswith(PERSIST_KEY_PREFIX) or not key.isdigit():
+        # Ключи без префикса выдавались до его появления
+        if not persistence.knows(key):
+            # Соответствие ключа записи в БД уже вытеснено - ожидание ничего не даст
+            await callback.answer("Срок оценки этой транскрипции истёк.")
+            await callback.message.edit_reply_markup(reply_markup=None)
+            return
+        transcription_id = await persistence.transcription_id(key, timeout=SCORE_RESOLVE_TIMEOUT)
+    else:
+        transcription_id = int(key)
+    if transcription_id is None:
+        await callback.answer("Транскрипция ещё сохраняется, попробуйте оценить чуть позже.")
+        return
     logging.info(f"Transcription id: {transcription_id}, score: {score}")
     await callback.answer()
 
-    status = await main_bd.set_transcription_score(transcription_id, score)
-
-    if status:
-        await callback.message.edit_reply_markup(reply_markup=None)
-
-    transcription = await main_bd.get_transcription_info(transcription_id)
-
-    # Проверка получения информации по транскрипции
-    if transcription:
-        # Получение длительности
-        duration = transcription['duration_seconds']
-        user_id = callback.from_user.id
-        # Получение данных о пользователе
-        user = await main_bd.get_user_info(user_id)
-
-        if user:
-            cash = user['cash']
-            # Обновление счёта пользователя в соответствии с длительностью аудиосообщения
-            new_cash, difference = await calculate_balance(cash, duration)
-            result = await main_bd.set_user_cash(user_id, new_cash)
-            if result:
-                await callback.message.answer(text=f"Спасибо за оценку!\nВам начислено:\n{difference:.2f} Монет")
-                # Проверка, если пользователь набрал 960 Монет, то его роль обновляется
-                if new_cash >= 960:
-                    if user['role'] < ROLE['beta-tester']:
-                        result_role = await main_bd.set_user_role(user_id, role=ROLE['beta-tester'])
-                        if result_role:
-                            await callback.message.answer(text=beta_tester_update_text)
-
-
+    result = await main_bd.score_transcription(transcription_id, score)
+    if result is None:
+        return
 
+    await callback.message.edit_reply_markup(reply_markup=None)
+    if result['scored']:
+        await callback.message.answer(text=f"Спасибо за оценку!\nВам начислено:\n{result['reward']:.2f} Монет")
+        # Пользователь набрал 960 Монет - роль уже обновлена
+        if result['promoted']:
+            await callback.message.answer(text=beta_tester_update_text)
 
 
-async def return_prediction(prediction: str, message: Message, keyboard: InlineKeyboardMarkup):
+async def return_prediction(prediction: str, chat_id: int, reply_to: int, keyboard: InlineKeyboardMarkup):
     if len(prediction) > MAX_MESSAGE_LENGTH:
         # Разбиваем текст на строки с учетом слов
         lines = split_text_by_words(prediction, line_length=MAX_MESSAGE_LENGTH)
@@ -291,11 +430,13 @@ async def return_prediction(prediction: str, message: Message, keyboard: InlineK
             input_file = FSInputFile(temp_file_path, filename="Транскрипция.txt")
 
             # Отправляем файл пользователю
-            await message.reply("Текст слишком большой для демонстрации в виде сообщения.\nТранскрипция в виде файла:")
-            await message.reply_document(input_file, reply_markup=keyboard)
+            await bot.send_message(chat_id, "Текст слишком большой для демонстрации в виде сообщения.\n"
+                                            "Транскрипция в виде файла:", reply_to_message_id=reply_to)
+            await bot.send_document(chat_id, input_file, reply_to_message_id=reply_to, reply_markup=keyboard)
     else:
         # Если длина нормальная, отправляем сразу
-        await message.reply(f"Транскрипция:\n{prediction}", reply_markup=keyboard)
+        await bot.send_message(chat_id, f"Транскрипция:\n{prediction}", reply_to_message_id=reply_to,
+                               reply_markup=keyboard)
 
 
 def split_text_by_words(text: str, line_length: int):
@@ -1,30 +1,35 @@
 import logging
 import os
-from aiogram.types import InputFile
+from typing import BinaryIO
 
 import aiohttp
 
+from http_client import UpstreamClient
+from transcoding import iter_chunks
+
 S3_URL = os.getenv('S3_URL')
+S3_MAX_CONNECTIONS = int(os.getenv('S3_MAX_CONNECTIONS', '8'))
+S3_READ_TIMEOUT = float(os.getenv('S3_READ_TIMEOUT', '60'))
+
+s3_client = UpstreamClient('data_loader', S3_URL, limit=S3_MAX_CONNECTIONS, read_timeout=S3_READ_TIMEOUT)
 
 
-async def send_file_to_s3(file_path: str, file_name: str, transcription_text: str):
+async def send_file_to_s3(audio: BinaryIO, file_name: str, transcription_text: str):
     try:
-        async with aiohttp.ClientSession() as session:
-            with open(file_path, 'rb') as file:
-                # Создаем объект FormData для передачи файла и других данных
-                form = aiohttp.FormData()
-                form.add_field('file', file, filename=file_name, content_type='audio/wav')
-                form.add_field('transcription', transcription_text)
-                form.add_field('filename', file_name)
-
-                # Отправляем POST-запрос
-                async with session.post(url=f'{S3_URL}/upload-to-s3/', data=form) as response:
-                    if response.status == 200:
-                        logging.info(f"Successfully uploaded {file_name} to S3.")
-                        return True
-                    else:
-                        logging.error(f'Error while sending file to S3: {response.status}')
-                        return False
+        # Создаем объект FormData для передачи аудио и других данных
+        form = aiohttp.FormData()
+        form.add_field('file', iter_chunks(audio), filename=file_name, content_type='audio/wav')
+        form.add_field('transcription', transcription_text)
+        form.add_field('filename', file_name)
+
+        # Отправляем POST-запрос
+        async with s3_client.post('/upload-to-s3/', data=form) as response:
+            if response.status == 200:
+                logging.info(f"Successfully uploaded {file_name} to S3.")
+                return True
+            else:
+                logging.error(f'Error while sending file to S3: {response.status}')
+                return False
     except aiohttp.ClientError as e:
         logging.error(f'Connection to S3 error: {e}')
         return False
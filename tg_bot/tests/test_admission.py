@@ -0,0 +1,162 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+SERVICE_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(SERVICE_DIR))
+import admission  # noqa: E402
+from admission import AdmissionController  # noqa: E402
+
+
+@pytest.fixture
+def unlimited(monkeypatch):
+    """Без лимитов по ролям: остаются только общие слоты."""
+    monkeypatch.setattr(admission, 'ROLE_CONCURRENCY', [0])
+    monkeypatch.setattr(admission, 'ROLE_AUDIO_SECONDS_PER_MINUTE', [0])
+
+
+async def run_job(controller: AdmissionController, user_id: int, role: int, seconds: float,
+                  log: list, release: asyncio.Event, name: str):
+    async with controller.admit(user_id, role, seconds):
+        log.append(name)
+        await release.wait()
+
+
+def test_concurrency_is_capped_per_role(monkeypatch):
+    monkeypatch.setattr(admission, 'ROLE_CONCURRENCY', [1, 2])
+    monkeypatch.setattr(admission, 'ROLE_AUDIO_SECONDS_PER_MINUTE', [0])
+
+    async def scenario():
+        controller = AdmissionController(slots=8)
+        log, release = [], asyncio.Event()
+        tasks = [asyncio.create_task(run_job(controller, user_id, role, 1, log, release, f'{user_id}-{i}'))
+                 for user_id, role in ((1, 0), (2, 1)) for i in range(3)]
+        await asyncio.sleep(0.01)
+        started = sorted(log)
+        release.set()
+        await asyncio.gather(*tasks)
+        return started, sorted(log), controller
+
+    started, finished, controller = asyncio.run(scenario())
+    # user - одно сообщение за раз, beta-tester - два
+    assert started == ['1-0', '2-0', '2-1']
+    assert len(finished) == 6
+    assert controller.active == 0
+
+
+def test_token_bucket_delays_user_over_audio_rate(monkeypatch):
+    monkeypatch.setattr(admission, 'ROLE_CONCURRENCY', [0])
+    # 10 секунд аудио в секунду, запас - 600 секунд
+    monkeypatch.setattr(admission, 'ROLE_AUDIO_SECONDS_PER_MINUTE', [600])
+
+    async def scenario():
+        controller = AdmissionController(slots=8)
+        loop = asyncio.get_running_loop()
+        async with controller.admit(1, 0, 600):
+            pass
+        started = loop.time()
+        async with controller.admit(1, 0, 2):
+            waited = loop.time() - started
+        # Другой пользователь бакет первого не тратит
+        started = loop.time()
+        async with controller.admit(2, 0, 2):
+            other_waited = loop.time() - started
+        return waited, other_waited
+
+    waited, other_waited = asyncio.run(scenario())
+    assert 0.15 <= waited < 1
+    assert other_waited < 0.05
+
+
+def test_slots_are_granted_round_robin_between_users(unlimited):
+    async def scenario():
+        controller = AdmissionController(slots=1)
+        log, events, tasks = [], {}, []
+        for user_id, name in ((1, 'a1'), (1, 'a2'), (1, 'a3'), (2, 'b1'), (3, 'c1')):
+            events[name] = asyncio.Event()
+            tasks.append(asyncio.create_task(run_job(controller, user_id, 0, 1, log, events[name], name)))
+            await asyncio.sleep(0)
+        positions = {user_id: controller.position(queue[0]) for user_id, queue in controller._waiting.items()}
+        # Отпускаем по одному: каждый завершившийся передаёт слот следующему
+        while not all(event.is_set() for event in events.values()):
+            events[log[-1]].set()
+            await asyncio.sleep(0.01)
+        await asyncio.gather(*tasks)
+        return log, positions, controller
+
+    log, positions, controller = asyncio.run(scenario())
+    # Пользователь 1 прислал три сообщения, но 2 и 3 не ждут, пока он закончит
+    assert log == ['a1', 'a2', 'b1', 'c1', 'a3']
+    assert positions == {1: 1, 2: 2, 3: 3}
+    assert controller.active == 0
+
+
+def test_cancelled_waiter_leaves_no_trace(unlimited):
+    async def scenario():
+        controller = AdmissionController(slots=1)
+        log, release = [], asyncio.Event()
+        holder = asyncio.create_task(run_job(controller, 1, 0, 1, log, release, 'a'))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(run_job(controller, 2, 0, 1, log, asyncio.Event(), 'b'))
+        await asyncio.sleep(0)
+        queued = 2 in controller._waiting
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        left_waiting = dict(controller._waiting)
+        # Отменён и обработчик, уже получивший слот
+        holder.cancel()
+        await asyncio.gather(holder, return_exceptions=True)
+        return queued, left_waiting, controller
+
+    queued, left_waiting, controller = asyncio.run(scenario())
+    assert queued
+    assert left_waiting == {}
+    assert controller.active == 0
+    assert controller._active_by_user == {}
+
+
+def test_failing_on_queued_keeps_place_in_queue(unlimited):
+    async def scenario():
+        controller = AdmissionController(slots=1)
+        release = asyncio.Event()
+        holder = asyncio.create_task(run_job(controller, 1, 0, 1, [], release, 'a'))
+        await asyncio.sleep(0)
+
+        async def on_queued(position):
+            raise RuntimeError('Flood control exceeded')
+
+        async def queued_job():
+            async with controller.admit(2, 0, 1, on_queued):
+                return True
+
+        waiter = asyncio.create_task(queued_job())
+        await asyncio.sleep(0)
+        release.set()
+        return await waiter, await holder, controller
+
+    admitted, _, controller = asyncio.run(scenario())
+    assert admitted
+    assert controller.active == 0
+
+
+def test_held_slot_is_released_by_job_result_or_timeout(unlimited):
+    async def scenario():
+        controller = AdmissionController(slots=2)
+        async with controller.admit(1, 0, 1) as ticket:
+            controller.hold(ticket, 'job-1', timeout=10)
+        async with controller.admit(2, 0, 1) as ticket:
+            controller.hold(ticket, 'job-2', timeout=0.01)
+        held = controller.active
+        released = controller.release_job('job-1')
+        released_again = controller.release_job('job-1')
+        await asyncio.sleep(0.05)
+        return held, released, released_again, controller
+
+    held, released, released_again, controller = asyncio.run(scenario())
+    assert held == 2
+    assert released and not released_again
+    # job-2 так и не ответила - слот освобождён по таймауту
+    assert controller.active == 0
+    assert controller._held == {}
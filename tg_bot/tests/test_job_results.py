@@ -0,0 +1,153 @@
+import asyncio
+import importlib.util
+import io
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+SERVICE_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(SERVICE_DIR))
+# У nn_service модуль с тем же именем, поэтому загружаем по пути под своим именем
+_spec = importlib.util.spec_from_file_location('bot_job_queue', SERVICE_DIR / 'job_queue.py')
+job_queue = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(job_queue)
+
+# run_bot импортирует job_queue по имени - отдаём ему этот же модуль
+sys.modules['job_queue'] = job_queue
+os.environ.setdefault('TELEGRAM_TOKEN', '123456:' + 'A' * 35)
+os.environ.setdefault('FSM_STORAGE', 'memory')
+os.environ.setdefault('PERSIST_DIR', tempfile.mkdtemp())
+import run_bot  # noqa: E402
+from aiogram.exceptions import TelegramBadRequest  # noqa: E402
+from aiogram.methods import EditMessageText  # noqa: E402
+from persistence import PersistenceWorker  # noqa: E402
+
+
+def reply(broker, result: dict, audio: bytes = b'RIFF', queue: str = job_queue.RESULT_QUEUE):
+    """Ответ так, как его публикует nn_service."""
+    return broker.publish(queue, json.dumps(result).encode() + b'\n' + audio, {'job_id': result.get('job_id')})
+
+
+def test_publish_job_sends_audio_and_metadata():
+    async def scenario():
+        job_queue.broker = broker = job_queue.InMemoryBroker()
+        job_id = await job_queue.publish_job(io.BytesIO(b'RIFF'), chat_id=1, message_id=2, priority=0)
+        message = broker._queue(job_queue.JOB_QUEUE).get_nowait()
+        return job_id, message
+
+    job_id, message = asyncio.run(scenario())
+    assert message.body == b'RIFF'
+    assert message.headers['job_id'] == job_id
+    assert message.headers['reply_to'] == job_queue.RESULT_QUEUE
+    assert (message.headers['chat_id'], message.headers['message_id']) == (1, 2)
+
+
+def test_result_is_handled_and_acked():
+    async def scenario():
+        job_queue.broker = broker = job_queue.InMemoryBroker()
+        handled = asyncio.Queue()
+
+        async def handle_result(result, audio):
+            await handled.put((result, audio))
+
+        await job_queue.start(handle_result)
+        await reply(broker, {'job_id': 'a', 'prediction': 'привет'})
+        result, audio = await asyncio.wait_for(handled.get(), 1)
+        await asyncio.sleep(0.01)
+        free_slots = broker._slots[job_queue.RESULT_QUEUE]._value
+        await job_queue.close()
+        return result, audio, free_slots
+
+    result, audio, free_slots = asyncio.run(scenario())
+    assert result == {'job_id': 'a', 'prediction': 'привет'}
+    assert audio == b'RIFF'
+    # Занят только слот, с которым доставка ждёт следующее сообщение
+    assert free_slots == job_queue.RESULT_PREFETCH - 1
+
+
+def test_failed_result_is_retried_once_then_dropped():
+    async def scenario():
+        job_queue.broker = broker = job_queue.InMemoryBroker()
+        calls = []
+
+        async def handle_result(result, audio):
+            calls.append(result['job_id'])
+            raise RuntimeError('Telegram is unavailable')
+
+        await job_queue.start(handle_result)
+        await reply(broker, {'job_id': 'a', 'prediction': 'x'})
+        await asyncio.sleep(0.05)
+        remaining = broker._queue(job_queue.RESULT_QUEUE).qsize()
+        await job_queue.close()
+        return calls, remaining
+
+    calls, remaining = asyncio.run(scenario())
+    assert calls == ['a', 'a']
+    assert remaining == 0
+
+
+def test_malformed_result_is_acked_and_dropped():
+    async def scenario():
+        job_queue.broker = broker = job_queue.InMemoryBroker()
+        calls = []
+
+        async def handle_result(result, audio):
+            calls.append(result)
+
+        await job_queue.start(handle_result)
+        await broker.publish(job_queue.RESULT_QUEUE, b'not json', {'job_id': 'a'})
+        await broker.publish(job_queue.RESULT_QUEUE, b'[1]\nRIFF', {'job_id': 'b'})
+        await asyncio.sleep(0.05)
+        remaining = broker._queue(job_queue.RESULT_QUEUE).qsize()
+        free_slots = broker._slots[job_queue.RESULT_QUEUE]._value
+        await job_queue.close()
+        return calls, remaining, free_slots
+
+    calls, remaining, free_slots = asyncio.run(scenario())
+    assert calls == []
+    assert remaining == 0
+    assert free_slots == job_queue.RESULT_PREFETCH - 1
+
+
+def test_redelivered_result_is_persisted_once(monkeypatch, tmp_path):
+    sent, edits = [], []
+
+    async def edit_message_text(text, chat_id, message_id):
+        edits.append(text)
+        if len(edits) == 1:
+            raise RuntimeError('Telegram is unavailable')
+        if len(edits) == 2:
+            raise TelegramBadRequest(EditMessageText(text=text), 'Bad Request: message is not modified')
+
+    async def send_message(chat_id, text, **kwargs):
+        sent.append((chat_id, text, kwargs['reply_markup']))
+
+    async def store(keys, prediction, duration):
+        pass
+
+    monkeypatch.setattr(run_bot.bot, 'edit_message_text', edit_message_text)
+    monkeypatch.setattr(run_bot.bot, 'send_message', send_message)
+    monkeypatch.setattr(run_bot.transcripts, 'store', store)
+    # Воркер не запущен: задачи остаются в outbox, БД и хранилище не нужны
+    worker = PersistenceWorker(directory=str(tmp_path))
+    monkeypatch.setattr(run_bot, 'persistence', worker)
+
+    async def scenario():
+        job_queue.broker = broker = job_queue.InMemoryBroker()
+        await job_queue.start(run_bot.handle_job_result)
+        await reply(broker, {'job_id': 'a', 'chat_id': '1', 'message_id': '2', 'user_id': '3',
+                             'prediction': 'привет', 'duration': '1.5'})
+        await asyncio.sleep(0.1)
+        await job_queue.close()
+
+    asyncio.run(scenario())
+    assert len(list(tmp_path.glob('*.json'))) == 1
+    assert worker._queue.qsize() == 1
+    assert worker._queue.get_nowait().audio == b'RIFF'
+    assert len(sent) == 1
+    chat_id, text, keyboard = sent[0]
+    key = next(tmp_path.glob('*.json')).stem
+    assert (chat_id, text) == (1, 'Транскрипция:\nпривет')
+    assert keyboard.inline_keyboard[0][0].callback_data == f'score:bad:{key}'
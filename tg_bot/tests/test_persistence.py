@@ -0,0 +1,102 @@
+import asyncio
+import io
+import sys
+from pathlib import Path
+
+SERVICE_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(SERVICE_DIR))
+import persistence  # noqa: E402
+from persistence import PersistenceWorker  # noqa: E402
+
+
+def test_small_audio_stays_in_memory_and_record_is_on_disk(tmp_path):
+    async def scenario():
+        worker = PersistenceWorker(directory=str(tmp_path))
+        key = await worker.submit(1, 2.0, 'привет', io.BytesIO(b'RIFF'))
+        return key, worker._queue.get_nowait()
+
+    key, job = asyncio.run(scenario())
+    assert job.audio == b'RIFF'
+    assert (tmp_path / f'{key}.json').exists()
+    assert not (tmp_path / f'{key}.wav').exists()
+
+
+def test_audio_over_in_memory_limit_is_spilled(tmp_path, monkeypatch):
+    monkeypatch.setattr(persistence, 'PERSIST_MAX_IN_MEMORY', 1)
+
+    async def scenario():
+        worker = PersistenceWorker(directory=str(tmp_path))
+        first = await worker.submit(1, 2.0, 'a', io.BytesIO(b'one'))
+        second = await worker.submit(1, 2.0, 'b', io.BytesIO(b'two'))
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert not (tmp_path / f'{first}.wav').exists()
+    assert (tmp_path / f'{second}.wav').read_bytes() == b'two'
+
+
+def test_stop_spills_audio_and_start_restores_it(tmp_path):
+    async def scenario():
+        worker = PersistenceWorker(directory=str(tmp_path))
+        key = await worker.submit(1, 2.0, 'привет', io.BytesIO(b'RIFF'))
+        await worker.stop()
+        restored = PersistenceWorker(directory=str(tmp_path))
+        restored.directory.mkdir(exist_ok=True)
+        await restored.start()
+        await restored.stop()
+        return key, restored
+
+    key, restored = asyncio.run(scenario())
+    assert (tmp_path / f'{key}.wav').read_bytes() == b'RIFF'
+    assert restored.knows(key)
+
+
+def test_job_is_persisted_from_memory_and_removed(tmp_path, monkeypatch):
+    uploads = []
+
+    async def add_transcription(user_id, duration):
+        return {'data': {'transcription_id': 7}}
+
+    async def send_file_to_s3(audio, name, prediction):
+        uploads.append((audio.read(), name))
+        return True
+
+    monkeypatch.setattr(persistence.main_bd, 'add_transcription', add_transcription)
+    monkeypatch.setattr(persistence.s3, 'send_file_to_s3', send_file_to_s3)
+
+    async def scenario():
+        worker = PersistenceWorker(directory=str(tmp_path))
+        await worker.start()
+        key = await worker.submit(1, 2.0, 'привет', io.BytesIO(b'RIFF'))
+        transcription_id = await worker.transcription_id(key, timeout=1)
+        await asyncio.sleep(0.05)
+        await worker.stop()
+        return transcription_id, worker
+
+    transcription_id, worker = asyncio.run(scenario())
+    assert transcription_id == 7
+    assert uploads == [(b'RIFF', '7')]
+    assert list(tmp_path.glob('p*')) == []
+    assert worker._in_memory == 0
+
+
+def test_unresolved_key_times_out_without_leaking_waiter(tmp_path):
+    async def scenario():
+        worker = PersistenceWorker(directory=str(tmp_path))
+        key = await worker.submit(1, 2.0, 'привет', None)
+        transcription_id = await worker.transcription_id(key, timeout=0.01)
+        return transcription_id, worker
+
+    transcription_id, worker = asyncio.run(scenario())
+    assert transcription_id is None
+    assert worker._waiters == {}
+
+
+def test_evicted_key_is_unknown(tmp_path, monkeypatch):
+    monkeypatch.setattr(persistence, 'PERSIST_RESOLVED_MAX', 1)
+    worker = PersistenceWorker(directory=str(tmp_path))
+    worker._resolve('pold', 1)
+    worker._resolve('pnew', 2)
+    assert not worker.knows('pold')
+    assert worker.knows('pnew')
+    assert not worker.knows('pmissing')
@@ -0,0 +1,58 @@
+import asyncio
+import io
+import sys
+from pathlib import Path
+
+import pytest
+from aiohttp import web
+
+SERVICE_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(SERVICE_DIR))
+import transcription_connection_module as tranc  # noqa: E402
+
+
+async def stream(lines: list[bytes], monkeypatch) -> tuple[str | None, list[str]]:
+    """Отдаёт lines как ответ /predict-stream и возвращает результат get_prediction_stream и частичные тексты."""
+    async def predict_stream(request: web.Request):
+        await request.read()
+        response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+        await response.prepare(request)
+        for line in lines:
+            await response.write(line)
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_post('/predict-stream', predict_stream)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    monkeypatch.setattr(tranc, 'NN_STREAM_API_URL', f'http://127.0.0.1:{port}/predict-stream')
+
+    partials = []
+
+    async def on_partial(text: str):
+        partials.append(text)
+
+    try:
+        return await tranc.get_prediction_stream(io.BytesIO(b'RIFF'), on_partial), partials
+    finally:
+        await tranc.nn_client.close()
+        await runner.cleanup()
+
+
+def test_stream_segments_are_joined(monkeypatch):
+    prediction, partials = asyncio.run(stream(
+        [b'{"text": "\xd0\xbf\xd1\x80\xd0\xb8\xd0\xb2\xd0\xb5\xd1\x82"}\n', b'{"text": "mir"}\n', b'{"done": true}\n'],
+        monkeypatch))
+    assert prediction == 'привет mir'
+    assert partials == ['привет', 'привет mir']
+
+
+@pytest.mark.parametrize('line', [b'{"text": "obor', b'[1]\n', b'{"start": 0}\n'])
+def test_malformed_stream_line_is_an_error(monkeypatch, line):
+    prediction, partials = asyncio.run(stream([b'{"text": "a"}\n', line], monkeypatch))
+    assert prediction is None
+    assert partials == ['a']
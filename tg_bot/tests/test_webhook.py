@@ -0,0 +1,109 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from aiohttp import ClientSession, web
+
+SERVICE_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(SERVICE_DIR))
+import webhook  # noqa: E402
+
+# Обновления в том виде, в каком их присылает Telegram
+VOICE_UPDATE = {'update_id': 100, 'message': {
+    'message_id': 5, 'date': 1700000000, 'from': {'id': 42, 'is_bot': False, 'first_name': 'A'},
+    'chat': {'id': 42, 'type': 'private'},
+    'voice': {'file_id': 'f', 'file_unique_id': 'u', 'duration': 3}}}
+CALLBACK_UPDATE = {'update_id': 101, 'callback_query': {
+    'id': '1', 'from': {'id': 43, 'is_bot': False, 'first_name': 'B'}, 'chat_instance': 'c',
+    'data': 'score:best:p0123', 'message': {'message_id': 6, 'date': 1700000000,
+                                            'chat': {'id': 43, 'type': 'private'}}}}
+CHANNEL_POST_UPDATE = {'update_id': 102, 'channel_post': {
+    'message_id': 7, 'date': 1700000000, 'chat': {'id': -1001, 'type': 'channel'}, 'text': 'x'}}
+
+
+def test_shard_key_uses_user_then_chat_then_update_id():
+    assert webhook.shard_key(VOICE_UPDATE) == 42
+    assert webhook.shard_key(CALLBACK_UPDATE) == 43
+    assert webhook.shard_key(CHANNEL_POST_UPDATE) == -1001
+    assert webhook.shard_key({'update_id': 103}) == 103
+
+
+async def start_app(app: web.Application) -> tuple[web.AppRunner, str]:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}'
+
+
+def test_front_forwards_update_to_worker_by_user():
+    async def scenario():
+        received = {0: [], 1: []}
+        runners, urls = [], []
+        for index in received:
+            async def record(request: web.Request, index=index):
+                received[index].append(await request.json())
+                return web.Response()
+
+            app = web.Application()
+            app.router.add_post(webhook.WEBHOOK_PATH, record)
+            runner, url = await start_app(app)
+            runners.append(runner)
+            urls.append(url)
+
+        front = webhook.WebhookFront('', worker_urls=urls)
+        app = web.Application()
+        app.router.add_post(webhook.WEBHOOK_PATH, front.handle)
+        app.on_startup.append(front.on_startup)
+        app.on_shutdown.append(front.on_shutdown)
+        runner, front_url = await start_app(app)
+        runners.append(runner)
+
+        statuses = []
+        async with ClientSession() as session:
+            for update in (VOICE_UPDATE, CALLBACK_UPDATE, VOICE_UPDATE):
+                async with session.post(front_url + webhook.WEBHOOK_PATH, data=json.dumps(update),
+                                        headers={'Content-Type': 'application/json'}) as response:
+                    statuses.append(response.status)
+            async with session.post(front_url + webhook.WEBHOOK_PATH, data=b'{') as response:
+                statuses.append(response.status)
+
+        for runner in runners:
+            await runner.cleanup()
+        return statuses, received
+
+    statuses, received = asyncio.run(scenario())
+    assert statuses == [200, 200, 200, 400]
+    # 42 % 2 == 0, 43 % 2 == 1: обновления одного пользователя всегда в одном обработчике
+    assert received[0] == [VOICE_UPDATE, VOICE_UPDATE]
+    assert received[1] == [CALLBACK_UPDATE]
+
+
+def test_unreachable_worker_makes_telegram_retry():
+    async def scenario():
+        front = webhook.WebhookFront('', worker_urls=['http://127.0.0.1:1'])
+        app = web.Application()
+        app.router.add_post(webhook.WEBHOOK_PATH, front.handle)
+        app.on_startup.append(front.on_startup)
+        app.on_shutdown.append(front.on_shutdown)
+        runner, front_url = await start_app(app)
+        async with ClientSession() as session:
+            async with session.post(front_url + webhook.WEBHOOK_PATH, json=VOICE_UPDATE) as response:
+                status = response.status
+        await runner.cleanup()
+        return status
+
+    assert asyncio.run(scenario()) == 503
+
+
+def test_worker_derives_result_queue_and_outbox_from_index():
+    env = {**os.environ, 'BOT_MODE': 'webhook-worker', 'WORKER_INDEX': '3', 'PERSIST_DIR': '/data/outbox',
+           'RESULT_QUEUE': 'results'}
+    output = subprocess.run(
+        [sys.executable, '-c', 'import job_queue, persistence; print(job_queue.RESULT_QUEUE, persistence.PERSIST_DIR)'],
+        cwd=SERVICE_DIR, env=env, capture_output=True, text=True, check=True).stdout
+    assert output.split() == ['results.3', '/data/outbox/worker-3']
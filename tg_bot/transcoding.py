@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import os
+import tempfile
+import time
+import wave
+from typing import AsyncIterator, BinaryIO
+
+# Сколько ffmpeg одновременно может работать (по умолчанию - по числу ядер)
+TRANSCODE_CONCURRENCY = int(os.getenv('TRANSCODE_CONCURRENCY', str(os.cpu_count() or 1)))
+# Предел времени одной конвертации, зависший ffmpeg убивается
+TRANSCODE_TIMEOUT = float(os.getenv('TRANSCODE_TIMEOUT', '120'))
+# Буферы аудио держатся в памяти и сбрасываются во временный файл, только если больше этого размера
+AUDIO_SPILL_BYTES = int(float(os.getenv('AUDIO_SPILL_MB', '16')) * 1024 * 1024)
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+CHUNK_SIZE = 64 * 1024
+
+_slots = asyncio.Semaphore(TRANSCODE_CONCURRENCY)
+
+
+class TranscodingError(Exception):
+    pass
+
+
+def audio_buffer() -> BinaryIO:
+    return tempfile.SpooledTemporaryFile(max_size=AUDIO_SPILL_BYTES)
+
+
+async def iter_chunks(buffer: BinaryIO) -> AsyncIterator[bytes]:
+    """Отдаёт содержимое буфера с начала. Буфер передаётся в aiohttp так, а не как файл,
+    потому что переданный файл aiohttp закрывает после отправки, а буфер нужен повторно."""
+    buffer.seek(0)
+    while chunk := buffer.read(CHUNK_SIZE):
+        yield chunk
+
+
+async def _feed(stdin: asyncio.StreamWriter, source: BinaryIO):
+    source.seek(0)
+    try:
+        while chunk := source.read(CHUNK_SIZE):
+            stdin.write(chunk)
+            await stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        # ffmpeg перестал читать вход; причина будет в stderr
+        pass
+    finally:
+        stdin.close()
+
+
+async def _collect(stdout: asyncio.StreamReader, destination: BinaryIO) -> int:
+    """Пишет PCM из stdout в WAV; заголовок с итоговым размером дописывается при закрытии."""
+    written = 0
+    with wave.open(destination, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(SAMPLE_WIDTH)
+        wav.setframerate(SAMPLE_RATE)
+        while chunk := await stdout.read(CHUNK_SIZE):
+            wav.writeframesraw(chunk)
+            written += len(chunk)
+    return written
+
+
+async def transcode_to_wav(source: BinaryIO) -> tuple[BinaryIO, float]:
+    """Конвертирует аудио из буфера в WAV 16 кГц моно через каналы ffmpeg, не блокируя event loop
+    и не создавая файлов. Возвращает новый буфер с WAV и длительность в секундах."""
+    queued = time.monotonic()
+    async with _slots:
+        waited = time.monotonic() - queued
+        if waited > 1:
+            logging.info(f'Transcoding waited {waited:.1f} s for a free slot')
+
+        # Аргументы передаются списком, без shell; на выходе сырой PCM, заголовок WAV собираем сами
+        try:
+            process = await asyncio.create_subprocess_exec(
+                'ffmpeg', '-nostdin', '-loglevel', 'error', '-i', 'pipe:0',
+                '-ar', str(SAMPLE_RATE), '-ac', '1', '-f', 's16le', 'pipe:1',
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+        except OSError as e:
+            raise TranscodingError(f'ffmpeg could not be started: {e}')
+
+        destination = audio_buffer()
+        try:
+            _, written, stderr = await asyncio.wait_for(asyncio.gather(
+                _feed(process.stdin, source),
+                _collect(process.stdout, destination),
+                process.stderr.read(),
+            ), TRANSCODE_TIMEOUT)
+            await process.wait()
+        except asyncio.TimeoutError:
+            destination.close()
+            process.kill()
+            await process.wait()
+            raise TranscodingError(f'ffmpeg timed out after {TRANSCODE_TIMEOUT:.0f} s')
+        except BaseException:
+            destination.close()
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+
+    if process.returncode != 0 or not written:
+        destination.close()
+        raise TranscodingError(f'ffmpeg failed: {stderr.decode(errors="replace").strip()}')
+    destination.seek(0)
+    return destination, written / (SAMPLE_RATE * SAMPLE_WIDTH)
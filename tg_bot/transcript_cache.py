@@ -0,0 +1,87 @@
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from typing import BinaryIO, Iterable
+
+import bd_connect_module as main_bd
+
+# Сколько последних транскрипций держать в памяти; остальные берутся из db_assist
+TRANSCRIPT_CACHE_SIZE = int(os.getenv('TRANSCRIPT_CACHE_SIZE', '5000'))
+# Через сколько обращений писать статистику кеша в лог
+TRANSCRIPT_CACHE_LOG_EVERY = 100
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_key(file_unique_id: str) -> str:
+    return f'file:{file_unique_id}'
+
+
+async def content_key(audio: BinaryIO) -> str:
+    """Ключ по содержимому аудио - для того же файла, загруженного заново с другим file_unique_id."""
+    def digest() -> str:
+        audio.seek(0)
+        sha = hashlib.sha256()
+        while chunk := audio.read(HASH_CHUNK_SIZE):
+            sha.update(chunk)
+        audio.seek(0)
+        return sha.hexdigest()
+
+    return f'sha256:{await asyncio.to_thread(digest)}'
+
+
+class TranscriptCache:
+    """Готовые транскрипции по ключу (file_unique_id или хеш аудио): LRU в памяти поверх таблицы db_assist.
+
+    Пересланные голосовые приходят с тем же file_unique_id, и для них не нужно ни скачивание, ни распознавание.
+    """
+
+    def __init__(self, max_size: int = TRANSCRIPT_CACHE_SIZE):
+        self.max_size = max(1, max_size)
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self._transcripts: 'OrderedDict[str, tuple[str, float]]' = OrderedDict()
+
+    def _remember(self, key: str, prediction: str, duration: float):
+        self._transcripts[key] = (prediction, duration)
+        self._transcripts.move_to_end(key)
+        while len(self._transcripts) > self.max_size:
+            self._transcripts.popitem(last=False)
+
+    async def lookup(self, key: str) -> tuple[str, float] | None:
+        """(транскрипция, длительность) или None."""
+        cached = self._transcripts.get(key)
+        if cached is not None:
+            self._transcripts.move_to_end(key)
+            self.memory_hits += 1
+        else:
+            found = await main_bd.get_cached_transcript(key)
+            if found is not None:
+                cached = found['prediction'], float(found['duration_seconds'])
+                self._remember(key, *cached)
+                self.db_hits += 1
+            else:
+                self.misses += 1
+
+        if self.lookups % TRANSCRIPT_CACHE_LOG_EVERY == 0:
+            stats = self.stats()
+            logging.info(f"Transcript cache: hit ratio {stats['hit_ratio']:.1%} of {stats['lookups']} lookups, "
+                         f"{stats['memory_hits']} in memory, {stats['db_hits']} in db_assist")
+        return cached
+
+    async def store(self, keys: Iterable[str], prediction: str, duration: float):
+        for key in keys:
+            self._remember(key, prediction, duration)
+            await main_bd.save_cached_transcript(key, prediction, duration)
+
+    @property
+    def lookups(self) -> int:
+        return self.memory_hits + self.db_hits + self.misses
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.db_hits
+        return {'size': len(self._transcripts), 'lookups': self.lookups, 'memory_hits': self.memory_hits,
+                'db_hits': self.db_hits, 'misses': self.misses,
+                'hit_ratio': hits / self.lookups if self.lookups else 0.0}
@@ -1,26 +1,83 @@
+import json
 import logging
 import os
+from typing import BinaryIO
 
 import aiohttp
 
+from http_client import UpstreamClient
+from transcoding import iter_chunks
+
 NN_API_URL = os.getenv('NN_API_URL')
+NN_STREAM_API_URL = os.getenv('NN_STREAM_API_URL', f'{NN_API_URL}-stream')
+NN_MAX_CONNECTIONS = int(os.getenv('NN_MAX_CONNECTIONS', '16'))
+# Ответа ждём долго: запрос может стоять в очереди инференса; в потоковом режиме - пауза между сегментами
+NN_READ_TIMEOUT = float(os.getenv('NN_READ_TIMEOUT', '600'))
+
+nn_client = UpstreamClient('nn_service', None, limit=NN_MAX_CONNECTIONS, read_timeout=NN_READ_TIMEOUT)
 
 
-async def get_prediction(temp_filename: str):
+async def get_prediction(audio: BinaryIO, priority: int = 0):
     try:
-        async with aiohttp.ClientSession() as session:
-            with open(temp_filename, 'rb') as audio_file:
-                form = aiohttp.FormData()
-                form.add_field('file', audio_file, content_type='audio/wav')
-
-                async with session.post(url=NN_API_URL, data=form) as resp:
-                    if resp.status == 200:
-                        result = await resp.json()
-                        prediction = result.get("prediction", "Ошибка предсказания")
-                        return prediction
-                    else:
-                        logging.error(f'Enternal error: {resp.status}')
-                        return None  # TODO свои классы ошибок
+        form = aiohttp.FormData()
+        form.add_field('file', iter_chunks(audio), filename='audio.wav', content_type='audio/wav')
+        # Приоритет в очереди nn_service - роль пользователя
+        form.add_field('priority', str(priority))
+
+        async with nn_client.post(NN_API_URL, data=form) as resp:
+            if resp.status == 200:
+                result = await resp.json()
+                prediction = result.get("prediction", "Ошибка предсказания")
+                return prediction
+            else:
+                logging.error(f'Enternal error: {resp.status}')
+                return None  # TODO свои классы ошибок
     except aiohttp.ClientError as e:
         logging.error(f'Connection to server error: {e}')
         return None
+
+
+def parse_stream_event(line: bytes) -> dict:
+    event = json.loads(line)
+    if not isinstance(event, dict):
+        raise ValueError(f'event must be a JSON object, got {type(event).__name__}')
+    return event
+
+
+async def get_prediction_stream(audio: BinaryIO, on_partial, priority: int = 0):
+    """Получает транскрипцию по частям. После каждого нового сегмента вызывает
+    await on_partial(текст_на_данный_момент). Возвращает полный текст или None при ошибке."""
+    segments = []
+    try:
+        form = aiohttp.FormData()
+        form.add_field('file', iter_chunks(audio), filename='audio.wav', content_type='audio/wav')
+        # Приоритет в очереди nn_service - роль пользователя
+        form.add_field('priority', str(priority))
+
+        async with nn_client.post(NN_STREAM_API_URL, data=form) as resp:
+            if resp.status != 200:
+                logging.error(f'Enternal error: {resp.status}')
+                return None
+
+            # Ответ приходит в формате NDJSON: одна JSON-строка на сегмент
+            async for line in resp.content:
+                if not line.strip():
+                    continue
+                event = parse_stream_event(line)
+                if 'error' in event:
+                    logging.error(f'Streaming transcription error: {event["error"]}')
+                    return None
+                if event.get('done'):
+                    return ' '.join(segments)
+                segments.append(event['text'])
+                await on_partial(' '.join(segments))
+    except aiohttp.ClientError as e:
+        logging.error(f'Connection to server error: {e}')
+        return None
+    except (ValueError, KeyError) as e:
+        # Строка обрезана или повреждена (например, прокси оборвал поток)
+        logging.error(f'Malformed transcription stream: {e!r}')
+        return None
+
+    logging.error('Transcription stream ended unexpectedly')
+    return None
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+from typing import List
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web, ClientError
+
+import http_client
+
+# Публичный адрес вебхука для Telegram; пустой - вебхук не регистрируется (локальная проверка POST-запросами)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+# Telegram присылает его в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+# Число процессов-обработчиков; обновления одного пользователя всегда попадают в один и тот же процесс
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', str(os.cpu_count() or 1)))
+# Процесс-обработчик номер i слушает WEBHOOK_WORKER_PORT + i
+WEBHOOK_WORKER_HOST = os.getenv('WEBHOOK_WORKER_HOST', '127.0.0.1')
+WEBHOOK_WORKER_PORT = int(os.getenv('WEBHOOK_WORKER_PORT', '8081'))
+# Адреса обработчиков на других машинах через запятую; если заданы, локальные процессы не запускаются
+WEBHOOK_WORKER_URLS = [url for url in os.getenv('WEBHOOK_WORKER_URLS', '').split(',') if url]
+# Номер процесса-обработчика; задаётся фронтом при запуске. По нему job_queue и persistence
+# выбирают свои очередь ответов RESULT_QUEUE.<номер> и каталог outbox PERSIST_DIR/worker-<номер>
+WORKER_INDEX = int(os.getenv('WORKER_INDEX', '0'))
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+WORKER_RESTART_DELAY = 1
+
+
+def shard_key(update: dict) -> int:
+    """Пользователь, к которому относится обновление; если его нет - чат, затем номер обновления."""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        user = value.get('from') or value.get('user')
+        if isinstance(user, dict) and 'id' in user:
+            return int(user['id'])
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if isinstance(chat, dict) and 'id' in chat:
+            return int(chat['id'])
+    return int(update.get('update_id', 0))
+
+
+async def serve(app: web.Application, host: str, port: int):
+    """Запускает приложение aiohttp и работает до SIGINT/SIGTERM."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f'Listening on {host}:{port}')
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_worker(dp: Dispatcher, bot: Bot):
+    """Процесс-обработчик: принимает обновления от фронта и обрабатывает их в фоне своим диспетчером."""
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, handle_in_background=True,
+                         secret_token=WEBHOOK_SECRET or None).register(app, path=WEBHOOK_PATH)
+    # Хуки startup/shutdown диспетчера (сессии, фоновое сохранение, очередь ответов) - как при polling
+    setup_application(app, dp, bot=bot)
+    await serve(app, WEBHOOK_WORKER_HOST, WEBHOOK_WORKER_PORT + WORKER_INDEX)
+
+
+class WebhookFront:
+    """Принимает обновления Telegram и пересылает каждое в процесс-обработчик по id пользователя.
+
+    У каждого обработчика свой event loop, поэтому бот использует все ядра, а состояние пользователя,
+    его лимиты и фоновые задачи остаются в одном процессе.
+    """
+
+    def __init__(self, script: str, workers: int = WEBHOOK_WORKERS, worker_urls: List[str] | None = None):
+        self.script = script
+        self.worker_urls = worker_urls if worker_urls is not None else WEBHOOK_WORKER_URLS
+        self.spawn = not self.worker_urls
+        if self.spawn:
+            self.worker_urls = [f'http://{WEBHOOK_WORKER_HOST}:{WEBHOOK_WORKER_PORT + index}'
+                                for index in range(max(1, workers))]
+        self.clients = [http_client.UpstreamClient(f'worker {index}', url, limit=100, read_timeout=10)
+                        for index, url in enumerate(self.worker_urls)]
+        self._processes: List[asyncio.subprocess.Process | None] = [None] * len(self.worker_urls)
+        self._supervisors: List[asyncio.Task] = []
+
+    def _worker_env(self, index: int) -> dict:
+        # Свои outbox и очередь ответов процесс выводит из WORKER_INDEX, как и запущенный вручную
+        return {**os.environ, 'BOT_MODE': 'webhook-worker', 'WORKER_INDEX': str(index)}
+
+    async def _supervise(self, index: int):
+        """Держит процесс-обработчик запущенным, перезапуская его после падения."""
+        while True:
+            process = await asyncio.create_subprocess_exec(sys.executable, self.script, env=self._worker_env(index))
+            self._processes[index] = process
+            logging.info(f'Webhook worker {index} started, pid {process.pid}')
+            code = await process.wait()
+            logging.error(f'Webhook worker {index} exited with code {code}, restarting')
+            await asyncio.sleep(WORKER_RESTART_DELAY)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get(SECRET_HEADER) != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        body = await request.read()
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return web.Response(status=400)
+
+        index = shard_key(update) % len(self.clients)
+        headers = {'Content-Type': 'application/json'}
+        if WEBHOOK_SECRET:
+            headers[SECRET_HEADER] = WEBHOOK_SECRET
+        try:
+            async with self.clients[index].post(WEBHOOK_PATH, data=body, headers=headers) as response:
+                return web.Response(status=response.status)
+        except ClientError as e:
+            # Не 200 - Telegram повторит доставку обновления позже
+            logging.error(f'Update {update.get("update_id")} is not delivered to worker {index}: {e}')
+            return web.Response(status=503)
+
+    async def on_startup(self, app: web.Application):
+        await http_client.start_all()
+        if self.spawn:
+            self._supervisors = [asyncio.create_task(self._supervise(index))
+                                 for index in range(len(self.worker_urls))]
+
+    async def on_shutdown(self, app: web.Application):
+        for task in self._supervisors:
+            task.cancel()
+        await asyncio.gather(*self._supervisors, return_exceptions=True)
+        running = [process for process in self._processes if process is not None and process.returncode is None]
+        for process in running:
+            process.terminate()
+        # Обработчики дожидаются своих задач и сохраняют outbox
+        await asyncio.gather(*(process.wait() for process in running))
+        await http_client.close_all()
+
+    async def run(self, dp: Dispatcher, bot: Bot):
+        if WEBHOOK_URL:
+            await bot.set_webhook(WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None,
+                                  allowed_updates=dp.resolve_used_update_types())
+            logging.info(f'Webhook is set to {WEBHOOK_URL}{WEBHOOK_PATH}')
+        await bot.session.close()
+
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, self.handle)
+        app.on_startup.append(self.on_startup)
+        app.on_shutdown.append(self.on_shutdown)
+        logging.info(f'Webhook front: {len(self.worker_urls)} workers, {self.worker_urls}')
+        await serve(app, WEBHOOK_HOST, WEBHOOK_PORT)